@@ -16,7 +16,7 @@ from managers import conversation_manager
 from middleware import FileValidator, RequestValidator
 from core.config import setup_logging, UPLOAD_FOLDER, ALLOWED_ORIGINS, MAX_CONTENT_LENGTH
 from alias_manager import get_alias_manager, has_system_alias_file
-from core.plotting import PlotGenerator
+from core.plotting import PlotGenerator, start_plot_pool, shutdown_plot_pool
 
 # Setup logging
 logger = setup_logging()
@@ -31,10 +31,14 @@ async def lifespan(app: FastAPI):
     Path(UPLOAD_FOLDER).mkdir(exist_ok=True)
     logger.info(f"Upload folder ready: {UPLOAD_FOLDER}")
     
+    # Spawn the plotting workers before serving requests
+    start_plot_pool()
+    
     yield
     
     # Shutdown
     logger.info("Shutting down Excel Chatbot API")
+    shutdown_plot_pool()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -530,6 +534,21 @@ async def generate_plot(request: PlotRequest):
         # Initialize plot generator
         plot_generator = PlotGenerator()
         
+        # Build both charts in parallel worker processes. gather waits for
+        # every chart before an error is raised, so none is left running
+        plot_coroutines = {}
+        if flattened_valid and sanitized_flattened:
+            plot_coroutines['bar'] = plot_generator.generate_bar_plots_async(sanitized_flattened)
+        if normal_valid and sanitized_normal:
+            plot_coroutines['sunburst'] = plot_generator.generate_sunburst_plots_async(sanitized_normal)
+        plot_results = dict(zip(
+            plot_coroutines,
+            await asyncio.gather(*plot_coroutines.values(), return_exceptions=True)
+        ))
+        for plot_result in plot_results.values():
+            if isinstance(plot_result, BaseException):
+                raise plot_result
+        
         # Generate plots based on valid inputs
         plots_generated = {}
         plot_types = []
@@ -540,9 +559,9 @@ async def generate_plot(request: PlotRequest):
         messages = []
         
         # Generate bar chart if flattened data is valid
-        if flattened_valid and sanitized_flattened:
+        if 'bar' in plot_results:
             logger.info(f"📊 [BAR] Generating bar chart from flattened data...")
-            bar_result = plot_generator.generate_bar_plots(sanitized_flattened)
+            bar_result = plot_results['bar']
             
             if bar_result.get('success'):
                 logger.info(f"✅ [BAR] Bar chart generated successfully")
@@ -558,9 +577,9 @@ async def generate_plot(request: PlotRequest):
                 messages.append(f"Bar chart failed: {bar_result.get('error')}")
         
         # Generate sunburst chart if normal data is valid
-        if normal_valid and sanitized_normal:
+        if 'sunburst' in plot_results:
             logger.info(f"🌅 [SUNBURST] Generating sunburst chart from normal data...")
-            sunburst_result = plot_generator.generate_sunburst_plots(sanitized_normal)
+            sunburst_result = plot_results['sunburst']
             
             if sunburst_result.get('success'):
                 logger.info(f"✅ [SUNBURST] Sunburst chart generated successfully")
@@ -665,7 +684,7 @@ async def save_file_async(file: UploadFile, file_location: str):
             raise
     
     # Run file I/O in thread pool
-    await asyncio.get_event_loop().run_in_executor(None, save_file)
+    await asyncio.get_running_loop().run_in_executor(None, save_file)
 
 async def process_file_async(conversation, file_location: str, original_filename: str = None):
     """Process file asynchronously."""
@@ -673,15 +692,19 @@ async def process_file_async(conversation, file_location: str, original_filename
         conversation.process_file(file_location, original_filename)
     
     # Run processing in thread pool
-    await asyncio.get_event_loop().run_in_executor(None, process_file)
+    await asyncio.get_running_loop().run_in_executor(None, process_file)
 
 async def process_query_async(conversation, query: str):
     """Process query asynchronously."""
+    # Alias enrichment awaits the LLM on the event loop; the rest of the
+    # pipeline is blocking and runs in the thread pool
+    enriched_query = await conversation.aenrich_query(query)
+    
     def process_query():
-        return conversation.get_response(query)
+        return conversation.get_response(query, enriched_query)
     
     # Run query processing in thread pool
-    return await asyncio.get_event_loop().run_in_executor(None, process_query)
+    return await asyncio.get_running_loop().run_in_executor(None, process_query)
 
 # --- Development Server ---
 if __name__ == '__main__':
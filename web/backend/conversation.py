@@ -50,13 +50,30 @@ class Conversation:
             logger.error(f"Full traceback:\n{traceback.format_exc()}")
             raise ValueError(f"Failed to process file: {str(e)}")
 
-    def get_response(self, query: str):
+    async def aenrich_query(self, query: str):
+        """
+        Enrich a user query with the system alias file, if one is available,
+        without blocking the event loop.
+        
+        Args:
+            query (str): User's natural language query
+            
+        Returns:
+            str: The enriched query, or the original query if there is no alias file
+        """
+        system_alias_file = get_system_alias_file_path()
+        if not system_alias_file:
+            return query
+        return await self.processor.aenrich_query(query, system_alias_file)
+
+    def get_response(self, query: str, enriched_query: str = None):
         """
         Process a user query and return the response.
         Automatically uses the system alias file if available.
         
         Args:
             query (str): User's natural language query
+            enriched_query (str): Query already enriched by aenrich_query, if any
             
         Returns:
             dict: Query results or error information
@@ -71,16 +88,18 @@ class Conversation:
                 logger.warning(f"WARNING: No files processed in conversation {self.id}")
                 raise ValueError("No files have been processed in this conversation")
             
-            # Check for system alias file
+            # Check for system alias file (not needed once the query is enriched)
             system_alias_file = None
-            if has_system_alias_file():
+            if enriched_query is not None:
+                logger.info("Using query enriched before processing")
+            elif has_system_alias_file():
                 system_alias_file = get_system_alias_file_path()
                 logger.info(f"Using system alias file: {system_alias_file}")
             else:
                 logger.info("No system alias file available - processing without alias enrichment")
             
             # Use multi-file query processing with system alias file (if available)
-            result = self.processor.process_multi_file_query(query, system_alias_file)
+            result = self.processor.process_multi_file_query(query, system_alias_file, enriched_query)
             logger.info(f"Successfully processed query for conversation {self.id}")
             return result
             
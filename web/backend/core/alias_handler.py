@@ -6,52 +6,186 @@ from Excel files and using LLM to enrich queries with context.
 """
 
 import pandas as pd
+import openpyxl
+import asyncio
 import logging
 import os
+import time
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import HumanMessage
 from .prompt import ALIAS_HANDLE_PROMPT
 from .llm import get_llm_instance
 
 logger = logging.getLogger(__name__)
 
+# Alias workbooks are streamed cell by cell without building DataFrames.
+# Prefer the Rust-based calamine reader when available; otherwise use
+# openpyxl in read-only mode, and pandas only for formats openpyxl can't open.
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
 
-def format_excel_sheets(file_path):
+# Office Open XML workbooks (.xlsx/.xlsm) are zip archives; legacy .xls files
+# are OLE compound documents. The alias manager stores every upload as .xlsx,
+# so the format is told from the file's first bytes, not its extension.
+ZIP_MAGIC = b'PK\x03\x04'
+
+# Optional Aho-Corasick automaton for matching alias tokens against queries
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# Recent enrichments are reused for this long, up to this many entries
+ENRICHMENT_TTL_SECONDS = 300
+MAX_RECENT_ENRICHMENTS = 256
+
+# Upper bound on threads used to parse alias sheets in parallel
+MAX_SHEET_WORKERS = 8
+
+# Result of a shared in-flight enrichment whose leader was cancelled
+_NO_RESULT = object()
+
+# Number of parsed alias files an enricher keeps. Each upload gets a new file,
+# so older entries are only evicted by this bound.
+MAX_CACHED_ALIAS_FILES = 4
+
+
+def _is_openpyxl_workbook(file_path):
+    """Return True if the file is a zip-based workbook that openpyxl can read."""
+    with open(file_path, 'rb') as f:
+        return f.read(len(ZIP_MAGIC)) == ZIP_MAGIC
+
+
+def _read_sheet_names(file_path):
+    """Return the sheet names of a workbook in order."""
+    if python_calamine is not None:
+        return python_calamine.CalamineWorkbook.from_path(file_path).sheet_names
+    if _is_openpyxl_workbook(file_path):
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    with pd.ExcelFile(file_path) as excel_file:
+        return excel_file.sheet_names
+
+
+def _iter_sheet_rows(file_path, sheet_name):
+    """Yield the raw cell values of each row of a sheet, header row first."""
+    if python_calamine is not None:
+        workbook = python_calamine.CalamineWorkbook.from_path(file_path)
+        yield from workbook.get_sheet_by_name(sheet_name).to_python()
+    elif _is_openpyxl_workbook(file_path):
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            yield from workbook[sheet_name].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        df = pd.read_excel(file_path, sheet_name=sheet_name, header=None, dtype=object)
+        yield from df.itertuples(index=False, name=None)
+
+
+def _cell_to_str(value):
+    """Convert a raw cell value to its display string; empty cells become ""."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if value != value:  # NaN from the pandas fallback
+            return ""
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+def _read_and_format_sheet(file_path, sheet_name):
     """
-    Format Excel sheets into a structured string representation.
+    Read one sheet and format each row as "column: value" pairs.
+    
+    Each call opens the workbook on its own, so it is safe to run from
+    several threads at once.
     
     Args:
         file_path (str): Path to the Excel file containing alias dictionary
+        sheet_name (str): Name of the sheet to read
         
     Returns:
-        dict: Dictionary with sheet names as keys and formatted content as values
+        tuple: (list of formatted row strings, set of lowercased cell values)
     """
-    excel_file = pd.ExcelFile(file_path)
-    output = {}
+    sheet_output = []
+    sheet_tokens = set()
+    rows = _iter_sheet_rows(file_path, sheet_name)
+    
+    header = next(rows, None)
+    if header is None:
+        return sheet_output, sheet_tokens
+    col_names = [
+        name if name != "" else f"Unnamed: {i}"
+        for i, name in enumerate(_cell_to_str(h) for h in header)
+    ]
     
-    for sheet_name in excel_file.sheet_names:
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
-        sheet_output = []
-        col_names = df.columns
-        
-        for index, row in df.iterrows():
-            row_strings = []
-            for col_name, value in zip(col_names, row):
-                if pd.notna(value):
-                    value_str = str(value)
-                    row_strings.append(f"{col_name}: {value_str}")
+    for row in rows:
+        row_strings = []
+        for col_name, cell in zip(col_names, row):
+            value = _cell_to_str(cell)
+            if value != "":
+                row_strings.append(f"{col_name}: {value}")
+                token = value.strip().lower()
+                if token:
+                    sheet_tokens.add(token)
+        # Skip rows with no values at all
+        if row_strings:
             sheet_output.append(", ".join(row_strings))
+    
+    return sheet_output, sheet_tokens
+
+
+def format_excel_sheets(file_path, tokens=None):
+    """
+    Format Excel sheets into a structured string representation.
+    
+    Sheets are parsed in parallel when the workbook has more than one.
+    
+    Args:
+        file_path (str): Path to the Excel file containing alias dictionary
+        tokens (set, optional): If given, filled with the lowercased cell values
         
+    Returns:
+        dict: Dictionary with sheet names as keys and formatted content as values
+    """
+    sheet_names = _read_sheet_names(file_path)
+    
+    def read_sheet(sheet_name):
+        return _read_and_format_sheet(file_path, sheet_name)
+    
+    if len(sheet_names) > 1:
+        with ThreadPoolExecutor(max_workers=min(MAX_SHEET_WORKERS, len(sheet_names))) as executor:
+            results = list(executor.map(read_sheet, sheet_names))
+    else:
+        results = [read_sheet(sheet_name) for sheet_name in sheet_names]
+    
+    output = {}
+    for sheet_name, (sheet_output, sheet_tokens) in zip(sheet_names, results):
         output[sheet_name] = sheet_output
+        if tokens is not None:
+            tokens.update(sheet_tokens)
     
     return output
 
 
-def get_alias_dictionary(file_path):
+def get_alias_dictionary(file_path, tokens=None):
     """
     Load and format alias dictionary from Excel file.
     
     Args:
         file_path (str): Path to the alias Excel file
+        tokens (set, optional): If given, filled with the lowercased cell values
         
     Returns:
         str: Formatted string representation of the alias dictionary
@@ -61,7 +195,7 @@ def get_alias_dictionary(file_path):
         Exception: For other file reading errors
     """
     try:
-        formatted_sheets = format_excel_sheets(file_path)
+        formatted_sheets = format_excel_sheets(file_path, tokens)
         
         return_string = ""
         for sheet_name, rows in formatted_sheets.items():
@@ -70,17 +204,38 @@ def get_alias_dictionary(file_path):
                 return_string += f"{row}\n"
             return_string += "\n"  # Empty line between sheets
         
-        logger.info(f"Successfully loaded alias dictionary from {file_path}")
+        logger.info("Successfully loaded alias dictionary from %s", file_path)
         return return_string
     
     except FileNotFoundError:
-        logger.error(f"Alias file not found: {file_path}")
+        logger.error("Alias file not found: %s", file_path)
         raise FileNotFoundError(f"Alias file '{file_path}' not found.")
     except Exception as e:
-        logger.error(f"Error reading alias file {file_path}: {str(e)}")
+        logger.error("Error reading alias file %s: %s", file_path, e)
         raise Exception(f"Error reading alias file: {str(e)}")
 
 
+def build_alias_matcher(tokens):
+    """
+    Build a matcher that reports whether a lowercased query contains any alias token.
+    
+    Args:
+        tokens (set): Lowercased alias values from the dictionary
+        
+    Returns:
+        callable: Function taking a lowercased query and returning bool
+    """
+    if ahocorasick is not None and tokens:
+        automaton = ahocorasick.Automaton()
+        for token in tokens:
+            automaton.add_word(token, token)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text), None) is not None
+    
+    tokens = frozenset(tokens)
+    return lambda text: any(token in text for token in tokens)
+
+
 def parse_enriched_query(llm_response):
     """
     Parse the LLM response to extract the enriched query.
@@ -96,40 +251,118 @@ def parse_enriched_query(llm_response):
     response_content = llm_response.strip()
     
     # Look for "### Enriched Query" section
-    if "### Enriched Query" in response_content:
-        enriched_part = response_content.split("### Enriched Query")[-1].strip()
-        # Remove any trailing markdown or extra text
-        lines = enriched_part.split('\n')
+    header = "### Enriched Query"
+    idx = response_content.rfind(header)
+    if idx >= 0:
+        start = idx + len(header)
         # Take the first non-empty line after the header
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                return line
-        return enriched_part
-    
-    # Look for common patterns in the response
-    lines = response_content.split('\n')
-    for line in lines:
-        line = line.strip()
-        # Skip empty lines and headers
-        if line and not line.startswith('#') and not line.startswith('**'):
-            # This is likely the enriched query
-            return line
+        line = _first_content_line(response_content, start, ('#',))
+        return line if line is not None else response_content[start:].strip()
+    
+    # Look for common patterns in the response, skipping empty lines and headers
+    line = _first_content_line(response_content, 0, ('#', '**'))
+    if line is not None:
+        # This is likely the enriched query
+        return line
     
     # If no clear pattern found, return the whole response
     return response_content
 
 
+def _first_content_line(text, start, skip_prefixes):
+    """
+    Scan text line by line from start and return the first stripped line that
+    is non-empty and does not begin with any of skip_prefixes, or None.
+    """
+    n = len(text)
+    i = start
+    while i < n:
+        j = text.find('\n', i)
+        if j < 0:
+            j = n
+        line = text[i:j].strip()
+        if line and not line.startswith(skip_prefixes):
+            return line
+        i = j + 1
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _abspath(path):
+    """Cached os.path.abspath; alias paths repeat on every query."""
+    return os.path.abspath(path)
+
+
+def _alias_file_key(file_path):
+    """
+    Cache key for an alias file: its absolute path with its modification time
+    and size, so a file replaced in place is parsed again.
+    
+    A file that can't be stat'ed gets (abs_path, None, None); reading it then
+    reports the error.
+    """
+    abs_path = _abspath(file_path)
+    try:
+        stat = os.stat(abs_path)
+    except OSError:
+        return (abs_path, None, None)
+    return (abs_path, stat.st_mtime_ns, stat.st_size)
+
+
 class AliasEnricher:
     """
     Handles alias enrichment for user queries using LLM.
     """
     
+    __slots__ = (
+        '_alias_files',
+        '_alias_files_lock',
+        '_inflight',
+        '_recent_enrichments',
+        '_recent_lock',
+    )
+    
     def __init__(self):
         """
         Initialize the alias enricher.
         """
-        self.alias_dictionary_cache = {}
+        # Parsed alias files, least recently used first:
+        # _alias_file_key -> [formatted dictionary, alias matcher, (prefix, suffix) or None]
+        self._alias_files = OrderedDict()
+        self._alias_files_lock = threading.Lock()
+        # Async enrichments currently running, keyed by (user_query, _alias_file_key)
+        self._inflight = {}
+        # Recent successful enrichments: key -> (expires_at, enriched_query)
+        self._recent_enrichments = OrderedDict()
+        self._recent_lock = threading.Lock()
+    
+    def _alias_file_entry(self, file_path):
+        """
+        Return the cache entry for an alias file, parsing it on first use.
+        
+        Args:
+            file_path (str): Path to alias Excel file
+            
+        Returns:
+            list: [formatted dictionary, alias matcher, (prefix, suffix) or None]
+        """
+        key = _alias_file_key(file_path)
+        with self._alias_files_lock:
+            entry = self._alias_files.get(key)
+            if entry is not None:
+                self._alias_files.move_to_end(key)
+        if entry is not None:
+            logger.debug("Using cached alias dictionary for %s", file_path)
+            return entry
+        
+        tokens = set()
+        entry = [get_alias_dictionary(file_path, tokens), build_alias_matcher(tokens), None]
+        with self._alias_files_lock:
+            self._alias_files[key] = entry
+            while len(self._alias_files) > MAX_CACHED_ALIAS_FILES:
+                self._alias_files.popitem(last=False)
+        logger.info("Cached alias dictionary from %s", file_path)
+        return entry
         
     def load_alias_dictionary(self, file_path):
         """
@@ -141,16 +374,122 @@ class AliasEnricher:
         Returns:
             str: Formatted alias dictionary
         """
-        # Use absolute path as cache key
-        abs_path = os.path.abspath(file_path)
+        return self._alias_file_entry(file_path)[0]
+    
+    def _contains_any_alias(self, query_lower, file_path):
+        """
+        Check whether the lowercased query mentions any value from the alias dictionary.
+        
+        Args:
+            query_lower (str): Lowercased user query
+            file_path (str): Path to alias Excel file
+            
+        Returns:
+            bool: True if at least one alias value occurs in the query
+        """
+        return self._alias_file_entry(file_path)[1](query_lower)
+    
+    def get_prompt_parts(self, file_path):
+        """
+        Get the alias prompt split around the user query, with caching.
+        
+        The alias dictionary is formatted into the template once per file, so
+        building a prompt is a single concatenation: prefix + user_query + suffix.
+        
+        Args:
+            file_path (str): Path to alias Excel file
+            
+        Returns:
+            tuple: (prefix, suffix) surrounding the user query in the prompt
+        """
+        entry = self._alias_file_entry(file_path)
         
-        if abs_path not in self.alias_dictionary_cache:
-            self.alias_dictionary_cache[abs_path] = get_alias_dictionary(file_path)
-            logger.info(f"Cached alias dictionary from {file_path}")
-        else:
-            logger.debug(f"Using cached alias dictionary for {file_path}")
+        parts = entry[2]
+        if parts is None:
+            template = ALIAS_HANDLE_PROMPT.format(
+                alias_dictionary=entry[0],
+                user_query="{user_query}"
+            )
+            # The query placeholder comes after the dictionary in the template
+            prefix, _, suffix = template.rpartition("{user_query}")
+            parts = (prefix, suffix)
+            entry[2] = parts
+            
+        return parts
+    
+    def _get_recent(self, key):
+        """Return a recent enrichment for key if it has not expired, else None."""
+        with self._recent_lock:
+            entry = self._recent_enrichments.get(key)
+            if entry is None:
+                return None
+            expires_at, enriched_query = entry
+            if expires_at < time.monotonic():
+                del self._recent_enrichments[key]
+                return None
+            return enriched_query
+    
+    def _remember(self, key, enriched_query):
+        """Store a successful enrichment, evicting the oldest entries past the size limit."""
+        with self._recent_lock:
+            self._recent_enrichments[key] = (time.monotonic() + ENRICHMENT_TTL_SECONDS, enriched_query)
+            self._recent_enrichments.move_to_end(key)
+            while len(self._recent_enrichments) > MAX_RECENT_ENRICHMENTS:
+                self._recent_enrichments.popitem(last=False)
+    
+    def _build_prompt(self, user_query, alias_file_path):
+        """
+        Build the enrichment prompt for a query.
+        
+        Args:
+            user_query (str): Original user query
+            alias_file_path (str): Path to alias Excel file
             
-        return self.alias_dictionary_cache[abs_path]
+        Returns:
+            str or None: The prompt, or None if the query needs no enrichment
+        """
+        # Skip the LLM round-trip when no alias term occurs in the query
+        if not self._contains_any_alias(user_query.lower(), alias_file_path):
+            logger.debug("No alias terms found, skipping enrichment: %s", user_query)
+            return None
+        
+        # Create prompt from the cached dictionary-filled template
+        prefix, suffix = self.get_prompt_parts(alias_file_path)
+        return prefix + user_query + suffix
+    
+    def _enrichment_messages(self, user_query, alias_file_path):
+        """
+        Build the LLM messages for enriching a query.
+        
+        Shared by enrich_query and aenrich_query. Loads the alias dictionary
+        on first use, so it may read the alias file.
+        
+        Args:
+            user_query (str): Original user query
+            alias_file_path (str): Path to alias Excel file
+            
+        Returns:
+            list or None: Messages for the LLM, or None if the query needs no enrichment
+        """
+        logger.debug("Enriching query: %s", user_query)
+        prompt = self._build_prompt(user_query, alias_file_path)
+        if prompt is None:
+            return None
+        return [HumanMessage(content=prompt)]
+    
+    def _finish_enrichment(self, key, response):
+        """Parse the LLM response into the enriched query and remember it under key."""
+        enriched_query = parse_enriched_query(response.content)
+        logger.info("Enriched query: %s", enriched_query)
+        self._remember(key, enriched_query)
+        return enriched_query
+    
+    def _enrichment_failed(self, user_query, error):
+        """Log a failed enrichment and return the original query."""
+        logger.error("Failed to enrich query '%s': %s", user_query, error)
+        # Return original query if enrichment fails
+        logger.warning("Returning original query due to enrichment failure")
+        return user_query
     
     def enrich_query(self, user_query, alias_file_path):
         """
@@ -161,47 +500,89 @@ class AliasEnricher:
             alias_file_path (str): Path to alias Excel file
             
         Returns:
-            str: Enriched query with alias context
-            
-        Raises:
-            ValueError: If query enrichment fails
+            str: Enriched query with alias context, or the original query on failure
         """
         try:
-            logger.info(f"Enriching query: {user_query}")
+            key = (user_query, _alias_file_key(alias_file_path))
+            enriched_query = self._get_recent(key)
+            if enriched_query is not None:
+                return enriched_query
             
-            # Get a new LLM instance for each call to cycle keys
-            llm = get_llm_instance()
-            
-            # Load alias dictionary
-            alias_dictionary = self.load_alias_dictionary(alias_file_path)
-            
-            # Create prompt
-            prompt = ALIAS_HANDLE_PROMPT.format(
-                alias_dictionary=alias_dictionary,
-                user_query=user_query
-            )
-            
-            # Get LLM response
-            message = HumanMessage(content=prompt)
-            response = llm.invoke([message])
+            messages = self._enrichment_messages(user_query, alias_file_path)
+            if messages is None:
+                return user_query
             
-            # Parse enriched query
-            enriched_query = parse_enriched_query(response.content)
+            # Get a new LLM instance for each call to cycle keys
+            response = get_llm_instance().invoke(messages)
+            return self._finish_enrichment(key, response)
             
-            logger.info(f"Original query: {user_query}")
-            logger.info(f"Enriched query: {enriched_query}")
+        except Exception as e:
+            return self._enrichment_failed(user_query, e)
+    
+    async def aenrich_query(self, user_query, alias_file_path):
+        """
+        Async version of enrich_query using the LLM's async interface.
+        
+        Concurrent calls for the same query and alias file share a single
+        LLM request; recent results are served from a short-lived cache.
+        
+        Args:
+            user_query (str): Original user query
+            alias_file_path (str): Path to alias Excel file
             
+        Returns:
+            str: Enriched query with alias context, or the original query on failure
+        """
+        key = (user_query, _alias_file_key(alias_file_path))
+        enriched_query = self._get_recent(key)
+        if enriched_query is not None:
             return enriched_query
+        
+        future = self._inflight.get(key)
+        if future is not None:
+            logger.debug("Awaiting in-flight enrichment for: %s", user_query)
+            enriched_query = await asyncio.shield(future)
+            if enriched_query is not _NO_RESULT:
+                return enriched_query
+            # The leader was cancelled before finishing; enrich on our own
+            # (or join whichever call picked it up first)
+            return await self.aenrich_query(user_query, alias_file_path)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            enriched_query = await self._aenrich_query(user_query, alias_file_path, key)
+            future.set_result(enriched_query)
+            return enriched_query
+        finally:
+            self._inflight.pop(key, None)
+            if not future.done():
+                # The leader was cancelled. Only this call was, so release
+                # the waiters instead of cancelling them too.
+                future.set_result(_NO_RESULT)
+    
+    async def _aenrich_query(self, user_query, alias_file_path, key):
+        """Run one async enrichment, returning the original query on failure."""
+        try:
+            # Reading the alias file on first use would block the event loop
+            messages = await asyncio.to_thread(self._enrichment_messages, user_query, alias_file_path)
+            if messages is None:
+                return user_query
+            
+            # Get a new LLM instance for each call to cycle keys, and await
+            # the response without blocking a worker thread
+            response = await get_llm_instance().ainvoke(messages)
+            return self._finish_enrichment(key, response)
             
         except Exception as e:
-            logger.error(f"Failed to enrich query '{user_query}': {str(e)}")
-            # Return original query if enrichment fails
-            logger.warning("Returning original query due to enrichment failure")
-            return user_query
+            return self._enrichment_failed(user_query, e)
     
     def clear_cache(self):
         """Clear the alias dictionary cache."""
-        self.alias_dictionary_cache.clear()
+        with self._alias_files_lock:
+            self._alias_files.clear()
+        with self._recent_lock:
+            self._recent_enrichments.clear()
         logger.info("Alias dictionary cache cleared")
 
 
@@ -213,15 +594,15 @@ def enrich_query_with_aliases(user_query, alias_file_path):
     """
     Convenience function to enrich a query with aliases.
     
+    Uses the shared default enricher so the parsed alias dictionary and
+    prompt caches survive across calls.
+    
     Args:
         user_query (str): Original user query
         alias_file_path (str): Path to alias Excel file
-        llm: Language model instance (optional, uses default if None)
         
     Returns:
         str: Enriched query
     """
-    llm = get_llm_instance()
-    enricher = AliasEnricher(llm)
-    
-    return enricher.enrich_query(user_query, alias_file_path) 
\ No newline at end of file
+    return default_alias_enricher.enrich_query(user_query, alias_file_path)
+
@@ -1,5 +1,8 @@
 import os
+import re
+import sys
 import logging
+import itertools
 from pathlib import Path
 import dotenv
 import threading
@@ -11,72 +14,81 @@ dotenv.load_dotenv(dotenv_path=env_path)
 
 # --- LLM Configuration with Pre-loaded Pool ---
 
-# Find all GOOGLE_API_KEY_n variables in the environment
-api_keys = [
-    key for key in [os.getenv(f"GOOGLE_API_KEY_{i+1}") for i in range(4)] # Check for up to 4 keys
-    if key is not None and key.strip() != ""
-]
+# Find all GOOGLE_API_KEY_n variables in the environment, ordered by n
+_API_KEY_PATTERN = re.compile(r'^GOOGLE_API_KEY_(\d+)$')
+
+def _discover_api_keys():
+    """Scan the environment once and return non-empty GOOGLE_API_KEY_n values sorted by n."""
+    pairs = []
+    for name, value in os.environ.items():
+        match = _API_KEY_PATTERN.match(name)
+        if match and value and value.strip():
+            pairs.append((int(match.group(1)), value))
+    pairs.sort()
+    return [value for _, value in pairs]
+
+api_keys = _discover_api_keys()
 
 if not api_keys:
     raise ValueError("At least one GOOGLE_API_KEY_n environment variable is required (e.g., GOOGLE_API_KEY_1)")
 
 LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash-preview-04-17")
 
-# Pre-load all LLM instances at startup to avoid threading issues
-_llm_pool = []
-_llm_index = 0
+# LLM instances are created lazily, one per API key, on first use
+_llm_pool = {}
+_llm_counter = itertools.count()
 _llm_lock = threading.Lock()
-_pool_initialized = False
+_pool_lock = threading.Lock()
 
-def _initialize_llm_pool():
-    """
-    Initialize the LLM pool with all available API keys.
-    This is called once during module import.
+# next() on itertools.count is atomic while the GIL is held, so round-robin
+# selection needs no lock. Free-threaded builds (3.13t) fall back to the lock.
+_GIL_ENABLED = getattr(sys, "_is_gil_enabled", lambda: True)()
+
+def _next_index(size):
+    """Return the next round-robin index in [0, size)."""
+    if _GIL_ENABLED:
+        return next(_llm_counter) % size
+    with _llm_lock:
+        return next(_llm_counter) % size
+
+def _get_llm(index):
     """
-    global _llm_pool, _pool_initialized
+    Get the LLM instance for the API key at the given index, creating it on first use.
+    Uses double-checked locking so each instance is constructed exactly once.
     
-    if _pool_initialized:
-        return
-        
-    try:
-        for i, api_key in enumerate(api_keys):
-            llm_instance = ChatGoogleGenerativeAI(
-                model=LLM_MODEL, 
-                google_api_key=api_key, 
-                temperature=0
-            )
-            _llm_pool.append(llm_instance)
-            logging.getLogger(__name__).info(f"Initialized LLM instance {i+1}/{len(api_keys)}")
+    Args:
+        index (int): Index into api_keys
         
-        _pool_initialized = True
-        logging.getLogger(__name__).info(f"LLM pool initialized with {len(_llm_pool)} instances")
-        
-    except Exception as e:
-        logging.getLogger(__name__).error(f"Failed to initialize LLM pool: {e}")
-        raise
+    Returns:
+        ChatGoogleGenerativeAI: The LLM instance bound to that API key
+    """
+    llm_instance = _llm_pool.get(index)
+    if llm_instance is None:
+        with _pool_lock:
+            llm_instance = _llm_pool.get(index)
+            if llm_instance is None:
+                try:
+                    llm_instance = ChatGoogleGenerativeAI(
+                        model=LLM_MODEL, 
+                        google_api_key=api_keys[index], 
+                        temperature=0
+                    )
+                except Exception as e:
+                    logging.getLogger(__name__).error("Failed to initialize LLM instance %d: %s", index + 1, e)
+                    raise
+                _llm_pool[index] = llm_instance
+                logging.getLogger(__name__).info("Initialized LLM instance %d/%d", index + 1, len(api_keys))
+    return llm_instance
 
 def get_next_llm_instance():
     """
-    Returns the next LLM instance from the pre-loaded pool in a thread-safe manner.
-    Uses round-robin selection with minimal lock time.
+    Returns the next LLM instance from the pool in a thread-safe manner.
+    Uses lock-free round-robin selection; instances are created on first use.
     
     Returns:
-        ChatGoogleGenerativeAI: A pre-initialized LLM instance
+        ChatGoogleGenerativeAI: An LLM instance
     """
-    global _llm_index
-    
-    if not _pool_initialized:
-        _initialize_llm_pool()
-    
-    if not _llm_pool:
-        raise RuntimeError("No LLM instances available in pool")
-    
-    # Use atomic operation with minimal lock time
-    with _llm_lock:
-        current_index = _llm_index
-        _llm_index = (_llm_index + 1) % len(_llm_pool)
-    
-    return _llm_pool[current_index]
+    return _get_llm(_next_index(len(api_keys)))
 
 def get_next_api_key():
     """
@@ -86,15 +98,7 @@ def get_next_api_key():
     logging.getLogger(__name__).warning("get_next_api_key() is deprecated. Use get_next_llm_instance() instead.")
     
     # Fallback to simple round-robin API key selection
-    global _llm_index
-    with _llm_lock:
-        current_index = _llm_index
-        _llm_index = (_llm_index + 1) % len(api_keys)
-    
-    return api_keys[current_index]
-
-# Initialize the pool when module is imported
-_initialize_llm_pool()
+    return api_keys[_next_index(len(api_keys))]
 
 # --- End LLM Configuration ---
 
@@ -111,6 +115,26 @@ ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://127
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+class StreamSafeFormatter(logging.Formatter):
+    """
+    Formatter that degrades non-encodable characters for non-UTF-8 streams.
+    The stream encoding is checked once at construction, so UTF-8 streams
+    pay nothing per record and other streams never hit UnicodeEncodeError.
+    """
+    
+    def __init__(self, fmt=None, stream=None):
+        super().__init__(fmt)
+        encoding = getattr(stream, 'encoding', None) or 'utf-8'
+        self._encoding = encoding
+        self._utf8 = encoding.lower().replace('-', '').replace('_', '') in ('utf8', 'utf8sig')
+    
+    def format(self, record):
+        s = super().format(record)
+        if self._utf8:
+            return s
+        return s.encode(self._encoding, 'replace').decode(self._encoding)
+
+
 def setup_logging():
     """Configure logging for the application with Unicode support."""
     import sys
@@ -137,10 +161,9 @@ def setup_logging():
             # Fallback if reconfigure fails
             pass
     
-    # Configure formatters
-    formatter = logging.Formatter(LOG_FORMAT)
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+    # Configure formatters; the console one guards against non-UTF-8 terminals
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    console_handler.setFormatter(StreamSafeFormatter(LOG_FORMAT, console_handler.stream))
     
     # Configure root logger
     logging.basicConfig(
@@ -156,7 +179,9 @@ def setup_logging():
     return logging.getLogger(__name__)
 
 # File validation
+_ALLOWED_EXTENSIONS = frozenset(ALLOWED_EXTENSIONS)
+
 def is_allowed_file(filename):
     """Check if file extension is allowed."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    dot = filename.rfind('.')
+    return dot != -1 and filename[dot + 1:].lower() in _ALLOWED_EXTENSIONS
@@ -5,31 +5,140 @@ This module handles the extraction and filtering of DataFrames based on
 hierarchical row and column selections from the multi-agent query system.
 """
 
+import logging
+import re
+
+import numpy as np
 import pandas as pd
 
 
-def search_column_in_multiindex(df, column_name):
+# One "<indent><key>: <value>" selection line; lines without ':' never match
+_PATH_LINE_RE = re.compile(r'^([^\S\n]*)([^:\n]*):([^\n]*)$', re.MULTILINE)
+
+# Optional Numba kernel for combining row masks on large frames. Below this
+# many rows the JIT compile costs more than the numpy reduction it replaces.
+NUMBA_MIN_ROWS = 200_000
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+logger = logging.getLogger(__name__)
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _combine_masks_numba(masks, mask_ids, path_feat_counts, out):
+        """OR over paths of the AND of each path's masks, one pass per row."""
+        n_paths = path_feat_counts.shape[0]
+        for i in prange(out.shape[0]):
+            any_path = False
+            ofs = 0
+            for p in range(n_paths):
+                all_feat = True
+                for k in range(path_feat_counts[p]):
+                    if not masks[mask_ids[ofs + k], i]:
+                        all_feat = False
+                        break
+                ofs += path_feat_counts[p]
+                if all_feat:
+                    any_path = True
+                    break
+            out[i] = any_path
+else:
+    _combine_masks_numba = None
+
+
+def _combine_masks(masks, path_mask_ids, n_rows):
+    """
+    OR together the AND of each path's masks.
+    
+    Args:
+        masks: List of distinct 1-D bool arrays
+        path_mask_ids: Per path, the indices into masks it requires
+        n_rows: Length of every mask
+        
+    Returns:
+        numpy.ndarray: Combined bool mask
+    """
+    if _combine_masks_numba is not None and n_rows >= NUMBA_MIN_ROWS:
+        out = np.empty(n_rows, dtype=bool)
+        _combine_masks_numba(
+            np.stack(masks),
+            np.array([i for ids in path_mask_ids for i in ids], dtype=np.intp),
+            np.array([len(ids) for ids in path_mask_ids], dtype=np.intp),
+            out,
+        )
+        return out
+    
+    path_masks = []
+    for ids in path_mask_ids:
+        # Combine conditions for this path with AND, in place
+        path_mask = masks[ids[0]].copy()
+        for i in ids[1:]:
+            path_mask &= masks[i]
+        path_masks.append(path_mask)
+    return np.stack(path_masks).any(axis=0)
+
+
+def _build_col_lookup(df, is_multiindex=None):
+    """
+    Map every name appearing at any level of the columns to its full column.
+    
+    For MultiIndex columns the first tuple containing a name wins, matching
+    a left-to-right scan of df.columns.
+    
+    Args:
+        df: DataFrame with MultiIndex or regular columns
+        is_multiindex: Whether df.columns is a MultiIndex, if already known
+        
+    Returns:
+        dict: Column name component -> full column key
+    """
+    if is_multiindex is None:
+        is_multiindex = isinstance(df.columns, pd.MultiIndex)
+    if not is_multiindex:
+        return {col: col for col in df.columns}
+    
+    lookup = {}
+    for col_tuple in df.columns:
+        for part in col_tuple:
+            lookup.setdefault(part, col_tuple)
+    return lookup
+
+
+def _build_level_index(columns):
+    """
+    Index MultiIndex columns by the value they hold at each level.
+    
+    Args:
+        columns: MultiIndex of column tuples
+        
+    Returns:
+        list: One dict per level mapping value -> set of column tuples
+    """
+    level_index = [{} for _ in range(columns.nlevels)]
+    for col_tuple in columns:
+        for level, value in enumerate(col_tuple):
+            level_index[level].setdefault(value, set()).add(col_tuple)
+    return level_index
+
+
+def search_column_in_multiindex(df, column_name, col_lookup=None):
     """
     Search for a column name in MultiIndex columns and return the full tuple.
     
     Args:
         df: DataFrame with MultiIndex columns
         column_name: Name to search for
+        col_lookup: Optional lookup from _build_col_lookup(df), reused across calls
         
     Returns:
         tuple: Full MultiIndex tuple for the column, or None if not found
     """
-    if not isinstance(df.columns, pd.MultiIndex):
-        # If it's not a MultiIndex, search in the regular index
-        if column_name in df.columns:
-            return column_name
-        return None
-
-    for col_tuple in df.columns:
-        if column_name in col_tuple:
-            return col_tuple
-    
-    return None
+    if col_lookup is None:
+        col_lookup = _build_col_lookup(df)
+    return col_lookup.get(column_name)
 
 
 def parse_row_paths(row_selection):
@@ -42,34 +151,28 @@ def parse_row_paths(row_selection):
     Returns:
         list: List of dictionaries, each representing a path
     """
-    if not row_selection.strip():
+    row_selection = row_selection.strip()
+    if not row_selection:
         return []
     
-    lines = row_selection.strip().split('\n')
     paths = []
     current_path = {}
     
-    for line in lines:
-        if not line.strip():
-            continue
-            
+    # Parse feature: value
+    for indent, feature, value in _PATH_LINE_RE.findall(row_selection):
         # Count indentation level
-        indent_level = (len(line) - len(line.lstrip())) // 4
+        indent_level = len(indent) // 4
+        feature = feature.strip()
+        value = value.strip()
         
-        # Parse feature: value
-        if ':' in line:
-            feature, value = line.strip().split(':', 1)
-            feature = feature.strip()
-            value = value.strip()
-            
-            # If this is a top-level feature (indent 0), start a new path
-            if indent_level == 0:
-                if current_path:  # Save previous path
-                    paths.append(current_path.copy())
-                current_path = {feature: value}
-            else:
-                # Add to current path
-                current_path[feature] = value
+        # If this is a top-level feature (indent 0), start a new path
+        if indent_level == 0:
+            if current_path:  # Save previous path
+                paths.append(current_path)
+            current_path = {feature: value}
+        else:
+            # Add to current path
+            current_path[feature] = value
     
     # Don't forget the last path
     if current_path:
@@ -88,40 +191,30 @@ def parse_col_paths(col_selection):
     Returns:
         list: List of dictionaries, each representing a path
     """
-    if not col_selection.strip():
+    col_selection = col_selection.strip()
+    if not col_selection:
         return []
     
-    lines = col_selection.strip().split('\n')
     paths = []
     current_path = {}
-    max_level = 0
     
-    for line in lines:
-        if not line.strip():
-            continue
-            
-        # Count indentation level
-        indent_level = (len(line) - len(line.lstrip())) // 4
+    # Parse level_X: value
+    for _, level_part, value in _PATH_LINE_RE.findall(col_selection):
+        level_part = level_part.strip()
         
-        # Parse level_X: value
-        if ':' in line:
-            level_part, value = line.strip().split(':', 1)
-            level_part = level_part.strip()
+        # Extract level number
+        if level_part.startswith('level_'):
+            level_num = int(level_part.split('_')[1])
             value = value.strip()
             
-            # Extract level number
-            if level_part.startswith('level_'):
-                level_num = int(level_part.split('_')[1])
-                max_level = max(max_level, level_num)
-                
-                # If this is level_1, start a new path
-                if level_num == 1:
-                    if current_path:  # Save previous path
-                        paths.append(current_path.copy())
-                    current_path = {level_num: value}
-                else:
-                    # Add to current path
-                    current_path[level_num] = value
+            # If this is level_1, start a new path
+            if level_num == 1:
+                if current_path:  # Save previous path
+                    paths.append(current_path)
+                current_path = {level_num: value}
+            else:
+                # Add to current path
+                current_path[level_num] = value
     
     # Don't forget the last path
     if current_path:
@@ -130,67 +223,87 @@ def parse_col_paths(col_selection):
     return paths
 
 
-def create_row_condition(df, row_paths):
+def _all_true(df):
+    """Return an all-True boolean Series aligned with df's rows."""
+    return pd.Series(np.ones(len(df), dtype=bool), index=df.index, copy=False)
+
+
+def create_row_condition(df, row_paths, col_lookup=None):
     """
     Create pandas condition for row filtering based on row paths.
     
     Args:
         df: DataFrame to filter
         row_paths: List of path dictionaries from parse_row_paths
+        col_lookup: Optional lookup from _build_col_lookup(df)
         
     Returns:
         pandas condition: Boolean condition for filtering
     """
     if not row_paths:
-        return pd.Series([True] * len(df), index=df.index)
+        return _all_true(df)
     
-    path_conditions = []
+    if col_lookup is None:
+        col_lookup = _build_col_lookup(df)
+    
+    # Distinct isin masks, and per path the indices of the ones it ANDs.
+    # Paths often repeat the same feature/value set; scan each pair only once
+    masks = []
+    mask_index = {}
+    # Value sets interned by their raw selection text
+    value_sets = {}
+    path_mask_ids = []
     
     for path in row_paths:
-        conditions_for_path = []
+        mask_ids = []
         
         for feature, value in path.items():
             if str(value).lower() == 'undefined':
                 continue  # Skip undefined conditions
                 
             # Search for the column in MultiIndex
-            col_tuple = search_column_in_multiindex(df, feature)
+            col_tuple = search_column_in_multiindex(df, feature, col_lookup)
             if col_tuple is not None:
                 # Create condition for this feature-value pair
-                if ',' in value:
-                    # Multiple values
-                    values = [v.strip() for v in value.split(',')]
-                    condition = df[col_tuple].isin(values)
-                else:
-                    # Single value
-                    condition = df[col_tuple].isin([value])
+                values = value_sets.get(value)
+                if values is None:
+                    if ',' in value:
+                        # Multiple values
+                        values = frozenset(v.strip() for v in value.split(','))
+                    else:
+                        # Single value
+                        values = frozenset((value,))
+                    value_sets[value] = values
                 
-                conditions_for_path.append(condition)
+                key = (col_tuple, values)
+                mask_id = mask_index.get(key)
+                if mask_id is None:
+                    mask_id = mask_index[key] = len(masks)
+                    # Nullable/Arrow columns give a masked boolean result; take
+                    # it straight to numpy bool (NA never matches) so the
+                    # combine step never runs on masked arrays
+                    masks.append(df[col_tuple].isin(values).to_numpy(dtype=bool, na_value=False))
+                mask_ids.append(mask_id)
         
-        # Combine conditions for this path with AND
-        if conditions_for_path:
-            path_condition = conditions_for_path[0]
-            for cond in conditions_for_path[1:]:
-                path_condition = path_condition & cond
-            path_conditions.append(path_condition)
-    
-    # Combine all path conditions with OR
-    if path_conditions:
-        final_condition = path_conditions[0]
-        for cond in path_conditions[1:]:
-            final_condition = final_condition | cond
-        return final_condition
+        if mask_ids:
+            path_mask_ids.append(mask_ids)
+    
+    # Combine path conditions with AND, then all paths with OR
+    if path_mask_ids:
+        final_condition = _combine_masks(masks, path_mask_ids, len(df))
+        return pd.Series(final_condition, index=df.index, copy=False)
     else:
-        return pd.Series([True] * len(df), index=df.index)
+        return _all_true(df)
 
 
-def create_column_tuples(df, col_paths):
+def create_column_tuples(df, col_paths, is_multiindex=None):
     """
     Create MultiIndex column tuples for column selection based on col paths.
     
     Args:
         df: DataFrame with MultiIndex columns
         col_paths: List of path dictionaries from parse_col_paths
+        is_multiindex: Whether df.columns is a MultiIndex, if already known
         
     Returns:
         list: List of column tuples
@@ -200,39 +313,50 @@ def create_column_tuples(df, col_paths):
     
     column_tuples = []
     
+    if is_multiindex is None:
+        is_multiindex = isinstance(df.columns, pd.MultiIndex)
+    
     # Determine max levels in MultiIndex
-    if isinstance(df.columns, pd.MultiIndex):
+    if is_multiindex:
         max_levels = df.columns.nlevels
+        level_index = _build_level_index(df.columns)
+        # Column positions for ordering matches; duplicate tuples need a scan
+        col_position = (
+            {col: i for i, col in enumerate(df.columns)} if df.columns.is_unique else None
+        )
     else:
         max_levels = 1
+        # Simple columns grouped by their string form, in df.columns order
+        columns_by_str = {}
+        for col in df.columns:
+            columns_by_str.setdefault(str(col), []).append(col)
     
     for path in col_paths:
         # Find ALL matching columns for this path (not just the first one)
-        if isinstance(df.columns, pd.MultiIndex):
-            for col_tuple in df.columns:
-                # Check if this column matches our pattern
-                matches = True
-                for level_num, value in path.items():
-                    if level_num <= max_levels:
-                        level_index = level_num - 1  # Convert to 0-based index
-                        if level_index < len(col_tuple):
-                            actual_val = col_tuple[level_index]
-                            if value != actual_val:
-                                matches = False
-                                break
-                        else:
-                            matches = False
-                            break
-                
-                if matches:
-                    column_tuples.append(col_tuple)
+        if is_multiindex:
+            # Intersect the columns holding each constrained level value
+            candidates = None
+            for level_num, value in path.items():
+                if level_num <= max_levels:
+                    # level_num - 1 converts to a 0-based level
+                    matching = level_index[level_num - 1].get(value, set())
+                    candidates = matching if candidates is None else candidates & matching
+                    if not candidates:
+                        break
+            
+            if candidates is None:
+                # No level constrained: every column matches
+                column_tuples.extend(df.columns)
+            elif candidates:
+                # Keep df.columns order
+                if col_position is not None:
+                    column_tuples.extend(sorted(candidates, key=col_position.__getitem__))
+                else:
+                    column_tuples.extend(col for col in df.columns if col in candidates)
         else:
             # Handle simple (non-MultiIndex) columns
             if 1 in path:  # level_1 is the only level for simple columns
-                target_value = path[1]
-                for col in df.columns:
-                    if str(col) == target_value:
-                        column_tuples.append(col)
+                column_tuples.extend(columns_by_str.get(path[1], ()))
     
     return column_tuples
 
@@ -250,46 +374,54 @@ def render_filtered_dataframe(df, row_selection, col_selection, feature_rows=Non
     Returns:
         DataFrame: Filtered DataFrame
     """
-    print("=== RENDERING FILTERED DATAFRAME ===")
-    
     # Parse row and column selections
     row_paths = parse_row_paths(row_selection)
     col_paths = parse_col_paths(col_selection)
     
-    print(f"Parsed {len(row_paths)} row paths")
-    print(f"Parsed {len(col_paths)} column paths")
+    logger.debug("Parsed %d row paths and %d column paths", len(row_paths), len(col_paths))
+    
+    is_multiindex = isinstance(df.columns, pd.MultiIndex)
+    
+    # Resolve column names once for all row paths and feature rows
+    col_lookup = _build_col_lookup(df, is_multiindex)
     
     # Create row filtering condition
-    row_condition = create_row_condition(df, row_paths)
-    print(f"Row condition filters {row_condition.sum()} out of {len(df)} rows")
+    row_condition = create_row_condition(df, row_paths, col_lookup)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Row condition filters %d out of %d rows", row_condition.sum(), len(df))
     
-    # Filter rows first
-    row_filtered_df = df[row_condition]
+    # Matching row positions; rows and columns are taken together below so
+    # the full-width row subset is never materialized
+    row_positions = np.flatnonzero(row_condition.to_numpy(dtype=bool, na_value=False))
     
     # Create column selection
-    column_tuples = create_column_tuples(df, col_paths)
-    print(f"Selected {len(column_tuples)} columns")
+    column_tuples = create_column_tuples(df, col_paths, is_multiindex)
+    logger.debug("Selected %d columns", len(column_tuples))
     
     # Include feature rows columns for clearer output
     feature_row_tuples = []
     if feature_rows:
         for feature_row in feature_rows:
-            feature_tuple = search_column_in_multiindex(df, feature_row)
+            feature_tuple = search_column_in_multiindex(df, feature_row, col_lookup)
             if feature_tuple:
                 feature_row_tuples.append(feature_tuple)
-        print(f"Added {len(feature_row_tuples)} feature row columns")
+        logger.debug("Added %d feature row columns", len(feature_row_tuples))
     
-    # Combine feature rows and selected columns
-    all_columns = feature_row_tuples + column_tuples
+    # Combine feature rows and selected columns, dropping repeats from
+    # overlapping paths (first occurrence wins)
+    all_columns = list(dict.fromkeys(feature_row_tuples + column_tuples))
     
-    if all_columns:
+    if all_columns and df.columns.is_unique:
         # Filter columns (feature rows + selected columns)
-        final_df = row_filtered_df[all_columns]
+        col_positions = df.columns.get_indexer(all_columns)
+        final_df = df.iloc[row_positions, col_positions]
+    elif all_columns:
+        # Duplicate labels can't be mapped to single positions
+        final_df = df.iloc[row_positions][all_columns]
     else:
         # No specific column selection, use all columns
-        final_df = row_filtered_df
+        final_df = df.iloc[row_positions]
     
-    print("Filtering completed successfully")
     return final_df
 
 
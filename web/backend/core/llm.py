@@ -1,11 +1,76 @@
+import logging
 from langchain_core.messages import HumanMessage
 import pandas as pd
 import numpy as np 
 import re
+import string
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from .utils import read_file
 from .prompt import DECOMPOSER_PROMPT, ROW_HANDLER_PROMPT, COL_HANDLER_PROMPT, FEATURE_ANALYSIS_PROMPT, SCHEMA_ANALYSIS_PROMPT
 from .config import get_next_llm_instance, LLM_MODEL
 
+# Feature analysis results keyed by a digest of the header rows. The model runs
+# at temperature 0, so re-uploading a file with the same headers reuses them.
+MAX_CACHED_FEATURE_NAMES = 128
+_feature_names_cache = OrderedDict()
+_feature_names_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+class _PromptTemplate:
+    """
+    A prompt template whose per-file fields are formatted once and reused.
+    
+    The splitter prompts mix per-query fields (query, keywords) with per-file
+    fields (feature names, structures) that repeat for every query on the same
+    file. The template is split at the per-query fields; the per-file runs in
+    between are formatted and cached by the string form of their values.
+    """
+    
+    def __init__(self, template, query_fields, maxsize=32):
+        self.query_fields = []
+        self.file_fields = []
+        runs = ['']
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            runs[-1] += literal.replace('{', '{{').replace('}', '}}')
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Unsupported format spec on prompt field '{field}'")
+            if field in query_fields:
+                self.query_fields.append(field)
+                runs.append('')
+            else:
+                runs[-1] += '{' + field + '}'
+                if field not in self.file_fields:
+                    self.file_fields.append(field)
+        self.runs = runs
+        self._format_runs = functools.lru_cache(maxsize=maxsize)(self._format_runs)
+    
+    def _format_runs(self, file_values):
+        values = dict(zip(self.file_fields, file_values))
+        return tuple(run.format(**values) for run in self.runs)
+    
+    def format(self, **kwargs):
+        """Same result as template.format(**kwargs)."""
+        # str() is what format() produces for these fields, and is hashable
+        runs = self._format_runs(tuple(str(kwargs[field]) for field in self.file_fields))
+        parts = [runs[0]]
+        for field, run in zip(self.query_fields, runs[1:]):
+            parts.append(str(kwargs[field]))
+            parts.append(run)
+        return ''.join(parts)
+
+
+_DECOMPOSER_TEMPLATE = _PromptTemplate(DECOMPOSER_PROMPT, {'query'})
+_ROW_HANDLER_TEMPLATE = _PromptTemplate(ROW_HANDLER_PROMPT, {'query', 'row_keywords'})
+_COL_HANDLER_TEMPLATE = _PromptTemplate(COL_HANDLER_PROMPT, {'query', 'col_keywords'})
+
+
 def get_llm_instance():
     """
     Returns a pre-loaded LLM instance from the thread-safe pool.
@@ -23,9 +88,9 @@ def get_schema(excel_content, feature_name_content):
     # Invoke the model
     try:
         response = llm.invoke([message])
-        print(response.content)
+        logger.debug("Model response:\n%s", response.content)
     except Exception as e:
-        print(f"Error invoking the model: {e}")
+        logger.error("Error invoking the model: %s", e)
     return response.content
 
 
@@ -80,6 +145,14 @@ def get_feature_names_from_headers(headers_content):
     Returns:
         dict: Dictionary containing 'is_matrix_table', 'feature_rows', and 'feature_cols'
     """
+    digest = hashlib.sha1(headers_content.encode('utf-8')).hexdigest()
+    with _feature_names_lock:
+        cached = _feature_names_cache.get(digest)
+        if cached is not None:
+            _feature_names_cache.move_to_end(digest)
+    if cached is not None:
+        return _copy_feature_names(cached)
+    
     llm = get_llm_instance()
     # Create the prompt using the template from prompt.py
     prompt = FEATURE_ANALYSIS_PROMPT.format(excel_content=headers_content)
@@ -89,11 +162,23 @@ def get_feature_names_from_headers(headers_content):
     # Invoke the model
     try:
         response = llm.invoke([message])
-        print(response.content)
+        logger.debug("Model response:\n%s", response.content)
     except Exception as e:
-        print(f"Error invoking the model: {e}")
+        logger.error("Error invoking the model: %s", e)
         raise
-    return parse_llm_feature_name_output(response.content)
+    result = parse_llm_feature_name_output(response.content)
+    
+    with _feature_names_lock:
+        _feature_names_cache[digest] = _copy_feature_names(result)
+        while len(_feature_names_cache) > MAX_CACHED_FEATURE_NAMES:
+            _feature_names_cache.popitem(last=False)
+    return result
+
+
+def _copy_feature_names(result):
+    """Copy a feature analysis result so callers can't mutate cached lists."""
+    return {key: list(value) if isinstance(value, list) else value
+            for key, value in result.items()}
 
 def get_feature_names(excel_file_path):
     llm = get_llm_instance()
@@ -106,9 +191,9 @@ def get_feature_names(excel_file_path):
     # Invoke the model
     try:
         response = llm.invoke([message])
-        print(response.content)
+        logger.debug("Model response:\n%s", response.content)
     except Exception as e:
-        print(f"Error invoking the model: {e}")
+        logger.error("Error invoking the model: %s", e)
     return parse_llm_feature_name_output(response.content)
 
 
@@ -128,9 +213,8 @@ def splitter(query, feature_rows, feature_cols, row_structure, col_structure):
     """
     llm = get_llm_instance()
     
-    print("=== DECOMPOSER AGENT ===")
     # Step 1: Decomposer Agent - Split query into row and column keywords
-    decomposer_prompt = DECOMPOSER_PROMPT.format(
+    decomposer_prompt = _DECOMPOSER_TEMPLATE.format(
         query=query,
         feature_rows=feature_rows,
         feature_cols=feature_cols,
@@ -139,126 +223,123 @@ def splitter(query, feature_rows, feature_cols, row_structure, col_structure):
     )
     
     decomposer_message = HumanMessage(content=decomposer_prompt)
-    decomposer_response = llm.invoke([decomposer_message])
-    print("Decomposer Response:")
-    print(decomposer_response.content)
     
-    # Parse decomposer output
-    decomposer_result = parse_decomposer_output(decomposer_response.content)
-    row_keywords = decomposer_result['row_keywords']
-    col_keywords = decomposer_result['col_keywords']
+    def invoke_row_handler(row_keywords):
+        # Step 2: Row Handler Agent - Process row keywords
+        row_handler_prompt = _ROW_HANDLER_TEMPLATE.format(
+            query=query,
+            feature_rows=feature_rows,
+            row_structure=row_structure,
+            row_keywords=row_keywords
+        )
+        row_handler_message = HumanMessage(content=row_handler_prompt)
+        return get_llm_instance().invoke([row_handler_message])
     
-    print()
-    print(f"Extracted Row Keywords: {row_keywords}")
-    print(f"Extracted Col Keywords: {col_keywords}")
-    
-    print()
-    print("=== ROW HANDLER AGENT ===")
-    # Step 2: Row Handler Agent - Process row keywords
-    row_handler_prompt = ROW_HANDLER_PROMPT.format(
-        query=query,
-        feature_rows=feature_rows,
-        row_structure=row_structure,
-        row_keywords=row_keywords
-    )
+    # Steps 2 and 3 only depend on the decomposer output, so the row and
+    # column handlers run concurrently on separate pooled instances. The
+    # decomposer is streamed so the row handler can start as soon as the
+    # Row Keywords section is complete, while Col Keywords is still arriving.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        row_future = None
+        early_row_keywords = None
+        decomposer_content = ''
+        for chunk in llm.stream([decomposer_message]):
+            decomposer_content += chunk.content
+            if row_future is None and '### Col Keywords' in decomposer_content:
+                early_row_keywords = parse_decomposer_output(decomposer_content)['row_keywords']
+                row_future = executor.submit(invoke_row_handler, early_row_keywords)
+        logger.debug("Decomposer response:\n%s", decomposer_content)
+        
+        # Parse decomposer output
+        decomposer_result = parse_decomposer_output(decomposer_content)
+        row_keywords = decomposer_result['row_keywords']
+        col_keywords = decomposer_result['col_keywords']
+        
+        logger.debug("Extracted row keywords: %s", row_keywords)
+        logger.debug("Extracted col keywords: %s", col_keywords)
+        
+        # Later output can still add row keywords; only then start over
+        if row_future is None or early_row_keywords != row_keywords:
+            row_future = executor.submit(invoke_row_handler, row_keywords)
+        
+        # Step 3: Column Handler Agent - Process column keywords
+        col_handler_prompt = _COL_HANDLER_TEMPLATE.format(
+            col_structure=col_structure,
+            query=query,
+            col_keywords=col_keywords
+        )
+        
+        col_handler_message = HumanMessage(content=col_handler_prompt)
+        col_handler_response = get_llm_instance().invoke([col_handler_message])
+        row_handler_response = row_future.result()
     
-    row_handler_message = HumanMessage(content=row_handler_prompt)
-    row_handler_response = llm.invoke([row_handler_message])
-    print("Row Handler Response:")
-    print(row_handler_response.content)
+    logger.debug("Row handler response:\n%s", row_handler_response.content)
     
     # Parse row handler output
     row_selection = parse_row_handler_output(row_handler_response.content)
     
-    print()
-    print("=== COL HANDLER AGENT ===")
-    # Step 3: Column Handler Agent - Process column keywords
-    col_handler_prompt = COL_HANDLER_PROMPT.format(
-        col_structure=col_structure,
-        query=query,
-        col_keywords=col_keywords
-    )
-    
-    col_handler_message = HumanMessage(content=col_handler_prompt)
-    col_handler_response = llm.invoke([col_handler_message])
-    print("Col Handler Response:")
-    print(col_handler_response.content)
+    logger.debug("Col handler response:\n%s", col_handler_response.content)
     
     # Parse column handler output
     col_selection = parse_col_handler_output(col_handler_response.content)
     
-    print()
-    print("=== FINAL RESULT ===")
     result = {
         'row_selection': row_selection,
         'col_selection': col_selection
     }
-    print("Final Result:")
-    print("Row Selection:")
-    print(result['row_selection'])
-    print()
-    print("Col Selection:")
-    print(result['col_selection'])
+    logger.debug("Row selection:\n%s", row_selection)
+    logger.debug("Col selection:\n%s", col_selection)
     return result
 
 
+# Section headers and "- keyword" bullets of the decomposer output
+_DECOMPOSER_LINE_RE = re.compile(
+    r'^[^\S\n]*(?:### (Row Keywords|Col Keywords|Thinking)|(-[^\n]*))', re.MULTILINE
+)
+_DECOMPOSER_SECTIONS = {
+    'Row Keywords': 'row_keywords',
+    'Col Keywords': 'col_keywords',
+    'Thinking': None,  # Stop parsing when we reach thinking section
+}
+
+# Body of a "### <Row|Col> Identifier" section, up to the next "###" header
+_IDENTIFIER_SECTION_RE = {
+    name: re.compile(
+        rf'^[^\S\n]*### {name} Identifier[^\n]*\n?(.*?)(?=^[^\S\n]*###|\Z)',
+        re.MULTILINE | re.DOTALL,
+    )
+    for name in ('Row', 'Col')
+}
+
+
 def parse_decomposer_output(output):
     """Parse decomposer agent output to extract row and column keywords."""
     result = {'row_keywords': [], 'col_keywords': []}
     current_section = None
     
-    lines = output.strip().split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if line.startswith('### Row Keywords'):
-            current_section = 'row_keywords'
-        elif line.startswith('### Col Keywords'):
-            current_section = 'col_keywords'
-        elif line.startswith('### Thinking'):
-            current_section = None  # Stop parsing when we reach thinking section
-        elif line and current_section and line.startswith('-'):
-            keyword = line.lstrip('- ').strip()  # Remove "- " prefix more robustly
+    for match in _DECOMPOSER_LINE_RE.finditer(output):
+        header, bullet = match.groups()
+        if header:
+            current_section = _DECOMPOSER_SECTIONS[header]
+        elif current_section:
+            keyword = bullet.lstrip('- ').strip()  # Remove "- " prefix more robustly
             if keyword:  # Only add non-empty keywords
                 result[current_section].append(keyword)
     
     return result
 
 
+def _parse_identifier_section(output, name):
+    """Return the body of the "### <name> Identifier" section, or '' if absent."""
+    match = _IDENTIFIER_SECTION_RE[name].search(output)
+    return match.group(1).strip() if match else ''
+
+
 def parse_row_handler_output(output):
     """Parse row handler agent output to extract row identifier in hierarchical format."""
-    lines = output.strip().split('\n')
-    row_identifier_lines = []
-    capturing = False
-    
-    for line in lines:
-        line_stripped = line.strip()
-        if line_stripped.startswith('### Row Identifier'):
-            capturing = True
-            continue
-        elif line_stripped.startswith('###') and capturing:
-            # Stop when we hit another section
-            break
-        elif capturing:
-            row_identifier_lines.append(line)
-            
-    return '\n'.join(row_identifier_lines).strip()
+    return _parse_identifier_section(output, 'Row')
 
 
 def parse_col_handler_output(output):
     """Parse col handler agent output to extract col identifier in hierarchical format."""
-    lines = output.strip().split('\n')
-    col_identifier_lines = []
-    capturing = False
-    
-    for line in lines:
-        line_stripped = line.strip()
-        if line_stripped.startswith('### Col Identifier'):
-            capturing = True
-            continue
-        elif line_stripped.startswith('###') and capturing:
-            break
-        elif capturing:
-            col_identifier_lines.append(line)
-            
-    return '\n'.join(col_identifier_lines).strip()
+    return _parse_identifier_section(output, 'Col')
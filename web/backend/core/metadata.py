@@ -1,37 +1,52 @@
+import copy
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np 
 
+# Upper bound on the number of row headers get_number_of_row_header reports;
+# it never reads more than this many rows below the first one
+MAX_HEADER_SCAN_ROWS = 12
+
+# Number of distinct (columns, names) inputs convert_df_headers_to_nested_dict
+# remembers
+MAX_CACHED_HEADER_DICTS = 64
+
+# openpyxl in read-only mode streams rows, so the header probe only decodes
+# the rows it asks for. calamine loads the whole sheet range even with nrows,
+# so it is not used here.
+OPENPYXL_EXTENSIONS = ('.xlsx', '.xlsm', '.xltx', '.xltm')
+
 def get_number_of_row_header(file_path):
     import logging
     logger = logging.getLogger(__name__)
     
     # Bước 1: Đọc tệp Excel với header đa cấp (2 dòng đầu)
-    logger.info(f"Reading Excel file for row header analysis: {file_path}")
-    df = pd.read_excel(file_path)
-    logger.info(f"DataFrame shape: {df.shape}")
-    logger.info(f"DataFrame columns: {df.columns}")
-    logger.info(f"DataFrame columns type: {type(df.columns)}")
+    # Only the first column of the first MAX_HEADER_SCAN_ROWS - 1 data rows
+    # is inspected, so don't let the reader decode the rest of the sheet
+    logger.info("Reading Excel file for row header analysis: %s", file_path)
+    engine = "openpyxl" if str(file_path).lower().endswith(OPENPYXL_EXTENSIONS) else None
+    df = pd.read_excel(file_path, usecols=[0], nrows=MAX_HEADER_SCAN_ROWS - 1, engine=engine)
+    logger.debug("DataFrame shape: %s, columns: %s", df.shape, df.columns)
 
     number_of_row_header = 1
     
     try:
         first_column = df.columns[0]
-        logger.info(f"First column: {first_column}")
-        logger.info(f"First column type: {type(first_column)}")
-        
         first_column_data = df[first_column]
-        logger.info(f"First column data type: {type(first_column_data)}")
-        logger.info(f"First column data shape: {first_column_data.shape if hasattr(first_column_data, 'shape') else 'No shape'}")
+        logger.debug("First column: %r, data shape: %s", first_column, first_column_data.shape)
         
-        for i, v in enumerate(first_column_data):
-            logger.info(f"Row {i}: {v} (is nan: {pd.isna(v)})")
-            if pd.isna(v):
-                number_of_row_header += 1
-            else:
-                break
-            if i > 10:  # Prevent infinite loop
-                logger.warning("Stopping header analysis after 10 rows")
-                break
+        # Count the leading NaNs of the first column in one vectorized pass
+        is_nan = first_column_data.isna().to_numpy()
+        if not len(is_nan):
+            pass  # No data rows below the first one
+        elif is_nan.all():
+            # Either the scan hit the cap or the column is entirely NaN;
+            # both report the maximum number of header rows
+            number_of_row_header = MAX_HEADER_SCAN_ROWS
+            logger.warning("Stopping header analysis after %d rows", MAX_HEADER_SCAN_ROWS)
+        else:
+            number_of_row_header += int(np.argmax(~is_nan))
                 
     except Exception as e:
         import traceback
@@ -39,11 +54,35 @@ def get_number_of_row_header(file_path):
         logger.error(f"Full traceback:\n{traceback.format_exc()}")
         raise
     
-    logger.info(f"Number of row headers determined: {number_of_row_header}")
+    logger.info("Number of row headers determined: %d", number_of_row_header)
     return number_of_row_header
 
 
 
+def _collapse_header_node(node):
+    """
+    Collapse a header trie node bottom-up: a node whose children are all
+    leaves maps to the sorted list of their keys, anything else stays a dict.
+    
+    Returns:
+    - tuple: (collapsed dict, whether every child of node is a leaf)
+    """
+    collapsed = {}
+    all_leaves = True
+    for key, child in node.items():
+        if not child:
+            collapsed[key] = {}  # Leaf
+            continue
+        all_leaves = False
+        child_collapsed, child_all_leaves = _collapse_header_node(child)
+        if child_all_leaves:
+            # All children are leaves: 'key' maps to a list of their keys.
+            collapsed[key] = sorted(child_collapsed) # Sort for consistent order
+        else:
+            collapsed[key] = child_collapsed
+    return collapsed, all_leaves
+
+
 def convert_df_headers_to_nested_dict(df, column_names_list):
     """
     Converts portions of a DataFrame's MultiIndex columns into a nested dictionary,
@@ -60,51 +99,6 @@ def convert_df_headers_to_nested_dict(df, column_names_list):
     - dict: Combined nested dictionary representing the hierarchical structure of all specified columns
     """
 
-    def _recursive_build(current_column_structure):
-        nested_structure = {}
-        
-        if current_column_structure.empty or current_column_structure.nlevels == 0:
-            return {} # Base case: leaf node or empty structure returns {}
-
-        try:
-            unique_values_at_this_level = list(current_column_structure.get_level_values(0).unique())
-        except IndexError: 
-            return {}
-
-        for value in unique_values_at_this_level:
-            if pd.isna(value):
-                continue
-            if value == 'Header':
-                continue 
-
-            mask_for_current_value = current_column_structure.get_level_values(0) == value
-            columns_for_this_value_branch = current_column_structure[mask_for_current_value]
-
-            child_result = {} # Default to empty dict if no further levels
-            if columns_for_this_value_branch.nlevels > 1:
-                next_level_structure = columns_for_this_value_branch.droplevel(0)
-                if not next_level_structure.empty and next_level_structure.nlevels > 0 :
-                    child_result = _recursive_build(next_level_structure)
-                # If next_level_structure is empty or has 0 levels, child_result remains {}
-                # which signifies this 'value' is a leaf from its parent's perspective.
-            # If columns_for_this_value_branch.nlevels <= 1, it means 'value' is a pre-leaf.
-            # The next_level_structure would be empty/0-levels, so _recursive_build on it
-            # would return {}, making child_result = {}.
-
-            # Check if child_result (representing children of 'value')
-            # consists entirely of leaf nodes (which are represented as empty dicts themselves).
-            if isinstance(child_result, dict) and child_result and \
-               all(isinstance(v, dict) and not v for v in child_result.values()):
-                # If so, 'value' maps to a list of its children's keys.
-                nested_structure[value] = sorted(list(child_result.keys())) # Sort for consistent order
-            else:
-                # Otherwise, 'value' maps to the structured dictionary of its children.
-                # This includes cases where child_result is {} (value is a leaf itself),
-                # or where children are a mix of lists and dicts, or just one non-leaf child.
-                nested_structure[value] = child_result
-        
-        return nested_structure
-
     # Validate inputs
     if not isinstance(column_names_list, list):
         raise ValueError("column_names_list must be a list")
@@ -116,43 +110,93 @@ def convert_df_headers_to_nested_dict(df, column_names_list):
         # For non-MultiIndex columns, return empty dict for each column name
         return {col_name: {} for col_name in column_names_list}
 
-    combined_result = {}
-    
-    for start_column_top_level_name in column_names_list:
-        try:
-            if start_column_top_level_name not in df.columns.get_level_values(0):
-                combined_result[start_column_top_level_name] = {}
-                continue
-            
-            top_level_mask = df.columns.get_level_values(0) == start_column_top_level_name
-            relevant_columns = df.columns[top_level_mask]
-        except Exception: 
-            combined_result[start_column_top_level_name] = {}
-            continue
+    # The result only depends on the column labels and the requested names,
+    # which repeat across queries on the same workbook. The key holds each
+    # level's labels with their types (so 1 and 1.0 don't share an entry)
+    # and the per-column codes, which keep the labels exactly as the levels
+    # store them. Callers get a copy so the cached dict is never mutated.
+    columns = df.columns
+    levels_key = tuple(
+        (
+            str(level.dtype),
+            # A missing label turns a numpy integer level's values into floats
+            isinstance(level.dtype, np.dtype) and level.dtype.kind in 'iu',
+            tuple((type(label), label) for label in level.tolist()),
+        )
+        for level in columns.levels
+    )
+    codes_key = tuple((level_codes.dtype.str, level_codes.tobytes()) for level_codes in columns.codes)
+    names_key = tuple((type(name), name) for name in column_names_list)
+    return copy.deepcopy(_build_header_dict_cached(levels_key, codes_key, names_key))
 
-        if relevant_columns.empty:
-            combined_result[start_column_top_level_name] = {}
-            continue
 
-        # If start_column_top_level_name itself has no sub-levels after selection,
-        # or if its only sub-level would be pruned by 'Header'.
-        if relevant_columns.nlevels <= 1: 
-            # Check if the "next level" would consist only of 'Header' or be empty
-            sub_structure_check = relevant_columns.droplevel(0)
-            if sub_structure_check.empty or \
-               (sub_structure_check.nlevels == 1 and \
-                list(sub_structure_check.get_level_values(0).unique()) == ['Header']):
-                combined_result[start_column_top_level_name] = {}
-                continue
-            # Fall through if there's actual structure to process below.
+@lru_cache(maxsize=MAX_CACHED_HEADER_DICTS)
+def _build_header_dict_cached(levels_key, codes_key, names_key):
+    """
+    Build the nested header dictionary for convert_df_headers_to_nested_dict
+    from the key it builds out of the MultiIndex levels, codes and the
+    requested top-level names.
+    The returned dict is shared between calls and must not be mutated.
+    """
+    level_labels = [[label for _, label in labels] for _, _, labels in levels_key]
+    level_is_int = [is_int for _, is_int, _ in levels_key]
+    names = [name for _, name in names_key]
+    codes = np.column_stack([np.frombuffer(raw, dtype=dtype) for dtype, raw in codes_key]).astype(np.intp)
 
-        structure_for_recursion = relevant_columns.droplevel(0)
-        
-        if structure_for_recursion.empty or structure_for_recursion.nlevels == 0:
+    # Only columns under a requested top-level name are needed. A NaN name
+    # never selects any columns
+    top_codes = {label: code for code, label in enumerate(level_labels[0])}
+    requested_codes = [
+        top_codes[name] for name in names
+        if not (pd.api.types.is_scalar(name) and pd.isna(name)) and name in top_codes
+    ]
+    relevant = codes[np.isin(codes[:, 0], requested_codes)]
+
+    # Below the top level, a NaN (code -1) or 'Header' component prunes the
+    # rest of that column's branch. Find where each column is cut in one
+    # vectorized pass over all levels, then build a trie of the kept code
+    # prefixes. Each trie node is [children by code, whether some column
+    # under it is cut by a NaN at the next level].
+    header_codes = np.array([
+        next((code for code, label in enumerate(labels) if label == 'Header'), -2)
+        for labels in level_labels[1:]
+    ], dtype=np.intp)
+    below_top = relevant[:, 1:]
+    kept = (below_top != -1) & (below_top != header_codes)
+    depths = np.cumprod(kept, axis=1).sum(axis=1) + 1
+    trie = [{}, False]
+    for column_codes, depth in zip(relevant.tolist(), depths.tolist()):
+        node = trie
+        for code in column_codes[:depth]:
+            node = node[0].setdefault(code, [{}, False])
+        if depth < len(column_codes) and column_codes[depth] == -1:
+            node[1] = True
+
+    def _to_labels(node, level):
+        # Turn a code trie into nested dicts of labels. As get_level_values
+        # does, an integer level's labels become floats next to a missing one.
+        children, has_missing = node
+        as_float = has_missing and level_is_int[level]
+        return {
+            float(level_labels[level][code]) if as_float else level_labels[level][code]:
+            _to_labels(child, level + 1)
+            for code, child in children.items()
+        }
+
+    combined_result = {}
+    
+    for start_column_top_level_name in names:
+        top_level_node = None
+        if not (pd.api.types.is_scalar(start_column_top_level_name) and pd.isna(start_column_top_level_name)):
+            top_code = top_codes.get(start_column_top_level_name)
+            if top_code is not None:
+                top_level_node = trie[0].get(top_code)
+
+        if not top_level_node or not top_level_node[0]:
             combined_result[start_column_top_level_name] = {}
             continue
 
-        combined_result[start_column_top_level_name] = _recursive_build(structure_for_recursion)
+        combined_result[start_column_top_level_name], _ = _collapse_header_node(_to_labels(top_level_node, 1))
 
     return combined_result
 
@@ -168,91 +212,47 @@ def convert_df_rows_to_nested_dict(df_input, hierarchy_columns_list, undefined_l
     
     Returns:
     - dict: Nested dictionary representing the hierarchical structure
+    
+    The input DataFrame is only read, never mutated.
     """
-    df_copy = df_input.copy()
 
-    # Helper function to determine if a structure is redundant (only Undefined or empty)
-    def _is_redundant_undefined_child(child_structure, current_undefined_label):
-        if not child_structure: # Handles {} or []
-            return True
-        
-        if isinstance(child_structure, list):
-            return all(item == current_undefined_label for item in child_structure)
-        
-        if isinstance(child_structure, dict):
-            for key, deeper_structure in child_structure.items():
-                if key != current_undefined_label:
-                    return False # Contains a meaningful key
-                # If key is undefined_label, check its child structure
-                if not _is_redundant_undefined_child(deeper_structure, current_undefined_label):
-                    return False # This 'Undefined' child has meaningful content
-            return True # All keys were undefined_label and their children were redundant
-        
-        return False # Should not be reached for dict/list/empty
-
-    def _recursive_build(current_df_slice, level_idx):
-        if level_idx >= len(hierarchy_columns_list):
-            return {} 
-
-        col_reference = hierarchy_columns_list[level_idx]
-        
-        # Handle both regular column names (strings) and MultiIndex column tuples
+    def _resolve_column(col_reference):
+        # Handle both regular column names (strings) and MultiIndex column
+        # tuples by resolving them to one position. A name matching several
+        # columns (a top-level MultiIndex name, duplicates) uses the first.
         try:
-            selected_data = current_df_slice[col_reference] 
+            loc = df_input.columns.get_loc(col_reference)
         except KeyError:
-            # If direct access fails, try to find the column in available columns
-            available_cols = current_df_slice.columns.tolist()
-            if col_reference in available_cols:
-                selected_data = current_df_slice[col_reference]
-            else:
-                # Return empty dict if column not found
-                return {}
+            return None  # Column not found: the hierarchy stops at this level
 
-        series_to_process = None
-        if isinstance(selected_data, pd.DataFrame):
-            import logging
-            logger = logging.getLogger(__name__)
-            
-            if selected_data.empty or len(selected_data.columns) == 0:
-                logger.warning(f"Selected DataFrame is empty or has no columns for column {col_reference}")
-                return {}
-            
-            # If selected_data (DataFrame) has no columns, .iloc[:, 0] will raise IndexError.
-            # This error will propagate as per "để lỗi tự báo".
-            try:
-                series_to_process = selected_data.iloc[:, 0]
-            except IndexError as e:
-                logger.error(f"IndexError accessing first column of DataFrame: {e}")
-                logger.error(f"DataFrame shape: {selected_data.shape}")
-                logger.error(f"DataFrame columns: {selected_data.columns}")
-                raise
-        else: # Assumed to be pd.Series if not DataFrame
-            series_to_process = selected_data
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.info(f"Selected data is Series with shape: {series_to_process.shape if hasattr(series_to_process, 'shape') else 'No shape'}")
-        
-        # .dropna().unique() will raise AttributeError if series_to_process is not Series-like.
-        # This error will propagate.
-        unique_vals = list(series_to_process.dropna().unique())
+        if isinstance(loc, slice):
+            position = loc.start
+        elif isinstance(loc, np.ndarray):
+            position = int(np.argmax(loc))
+        else:
+            position = loc
+        return df_input.iloc[:, position].to_numpy()
 
-        # Build the dictionary for the current level first
-        temp_current_level_dict = {}
-        for val in unique_vals:
-            next_slice = current_df_slice[series_to_process == val]
-            child_dict = _recursive_build(next_slice, level_idx + 1)
-            temp_current_level_dict[val] = child_dict
-        
-        # Prune redundant "Undefined" keys
+    def _build_level(node):
+        # Build the dictionary for the current level, pruning redundant
+        # "Undefined" keys as we go. Children are already pruned, so a
+        # remaining "Undefined" key always has meaningful content below it:
+        # a child built here is redundant (only Undefined or empty) exactly
+        # when it is empty
         final_current_level_dict = {}
-        for key, sub_structure in temp_current_level_dict.items():
-            if key == undefined_label and _is_redundant_undefined_child(sub_structure, undefined_label):
+        # Built children are never empty lists, so "terminal" is just "empty"
+        all_terminal = True
+        for key, child_node in node.items():
+            sub_structure = _build_level(child_node)
+            if key == undefined_label and not sub_structure:
                 continue # Skip this redundant "Undefined" key
             final_current_level_dict[key] = sub_structure
+            if sub_structure:
+                all_terminal = False
         
         # Convert to list of keys if all children are terminal (empty dicts)
-        if final_current_level_dict and all(isinstance(v, dict) and not v for v in final_current_level_dict.values()):
-            return list(final_current_level_dict.keys()) # No sort, as per user's last snippet
+        if final_current_level_dict and all_terminal:
+            return list(final_current_level_dict) # No sort, as per user's last snippet
         else:
             return final_current_level_dict
 
@@ -263,5 +263,32 @@ def convert_df_rows_to_nested_dict(df_input, hierarchy_columns_list, undefined_l
     if not hierarchy_columns_list:
         return {}
     
+    # Resolve each hierarchy column once; a missing column ends the hierarchy
+    level_arrays = []
+    for col_reference in hierarchy_columns_list:
+        column_values = _resolve_column(col_reference)
+        if column_values is None:
+            break
+        level_arrays.append(column_values)
+
+    if not level_arrays:
+        return {}  # The first hierarchy column is missing: nothing to group
+
+    # Group rows by their hierarchy values in one vectorized pass, then insert
+    # each distinct combination into a trie in order of first appearance.
+    # A NaN ends that row's path, as dropna() did for each level.
+    combinations = pd.DataFrame(dict(enumerate(level_arrays)))
+    first_rows = np.flatnonzero(~combinations.duplicated().to_numpy())
+    # Vectorized NaN check: each path's depth is its count of leading
+    # non-NaN levels, so the walk below needs no per-value isna calls
+    path_values = [values[first_rows] for values in level_arrays]
+    not_nan = ~np.column_stack([pd.isna(values) for values in path_values])
+    depths = np.cumprod(not_nan, axis=1).sum(axis=1)
+    root = {}
+    for i, depth in enumerate(depths.tolist()):
+        node = root
+        for values in path_values[:depth]:
+            node = node.setdefault(values[i], {})
+
     # Errors from invalid inputs or structure will propagate.
-    return _recursive_build(df_copy, 0)
\ No newline at end of file
+    return _build_level(root)
\ No newline at end of file
@@ -3,31 +3,144 @@ Plotting module for Excel Chatbot
 Handles plot generation based on user prompts and table data
 """
 
+import asyncio
+import copy
 import json
 import base64
+import hashlib
 import io
 import logging
+import logging.handlers
+import multiprocessing
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import lru_cache
 from typing import Dict, List, Any, Optional, Tuple
 from pathlib import Path
 import tempfile
 import os
 
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib
-import plotly.express as px
-from langchain_core.tools import tool
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-
-from .config import LLM_MODEL
-
-# Configure matplotlib backend
-matplotlib.use('Agg')
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Number of hierarchy levels below the root a drill-down sunburst renders
+SUNBURST_DRILLDOWN_LEVELS = 2
+
+# Enhanced sunburst configuration with square layout
+SUNBURST_LAYOUT = dict(
+    margin=dict(t=80, l=25, r=25, b=25),  # Reduced top margin since no title
+    font=dict(size=11),
+    showlegend=False,
+    width=600,   # Set fixed width for square aspect
+    height=600   # Set fixed height for square aspect
+)
+
+# The hover template already shows the value, so px.sunburst needs no hover_data
+SUNBURST_TRACE = dict(
+    insidetextorientation='radial',
+    textinfo="label+percent parent",
+    maxdepth=6,
+    branchvalues="total",
+    hovertemplate='<b>%{label}</b><br>' +
+                  'Value: %{value}<br>' +
+                  'Percentage of parent: %{percentParent}<br>' +
+                  'Path: %{currentPath}<br>' +
+                  '<extra></extra>'
+)
+
+# Successful plot results keyed by a digest of their inputs. Refreshing or
+# re-plotting the same table reuses them instead of rebuilding the figures.
+MAX_CACHED_PLOTS = 32
+_plot_cache = OrderedDict()
+_plot_cache_lock = threading.Lock()
+
+# Worker processes for the async plot methods. Plotly's figure validation holds
+# the GIL, so separate processes let concurrent requests build plots in parallel
+# without blocking the event loop. Workers are spawned rather than forked so
+# they never inherit the server's threads and locks; start_plot_pool() starts
+# and warms them up so the first request doesn't pay for it. Spawned workers
+# don't run setup_logging(), so their log records are queued back to this
+# process and handled by the app's own handlers.
+MAX_PLOT_WORKERS = 4
+_plot_pool = None
+_plot_log_listener = None
+_plot_pool_lock = threading.Lock()
+
+
+def _init_plot_worker(log_queue, log_level: int):
+    """Send a plotting worker's log records to the parent process."""
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(log_level)
+
+
+def _warm_plot_worker():
+    """Load the plotting dependencies in a worker ahead of the first plot."""
+    import plotly.express  # noqa: F401
+
+
+def _get_plot_pool() -> ProcessPoolExecutor:
+    """Return the shared plotting process pool, creating it on first use."""
+    global _plot_pool, _plot_log_listener
+    with _plot_pool_lock:
+        if _plot_pool is None:
+            context = multiprocessing.get_context("spawn")
+            log_queue = context.Queue()
+            root = logging.getLogger()
+            _plot_log_listener = logging.handlers.QueueListener(
+                log_queue, *root.handlers, respect_handler_level=True
+            )
+            _plot_log_listener.start()
+            _plot_pool = ProcessPoolExecutor(
+                max_workers=min(MAX_PLOT_WORKERS, os.cpu_count() or 1),
+                mp_context=context,
+                initializer=_init_plot_worker,
+                initargs=(log_queue, root.getEffectiveLevel())
+            )
+        return _plot_pool
+
+
+def start_plot_pool():
+    """
+    Start the plotting worker processes and wait until each has imported
+    plotly. Workers are only spawned as tasks are submitted, so one warm-up
+    task is queued per worker.
+    """
+    pool = _get_plot_pool()
+    workers = min(MAX_PLOT_WORKERS, os.cpu_count() or 1)
+    wait([pool.submit(_warm_plot_worker) for _ in range(workers)])
+    logger.info(f"Started {workers} plotting worker processes")
+
+
+def shutdown_plot_pool():
+    """Shut down the plotting process pool if it was started."""
+    global _plot_pool, _plot_log_listener
+    with _plot_pool_lock:
+        if _plot_pool is not None:
+            _plot_pool.shutdown(cancel_futures=True)
+            _plot_pool = None
+        if _plot_log_listener is not None:
+            _plot_log_listener.stop()
+            _plot_log_listener = None
+
+
+@lru_cache(maxsize=16)
+def _compile_keyword_pattern(keywords: Tuple[str, ...]) -> re.Pattern:
+    """Compile keywords into one regex matching any of them as a substring."""
+    return re.compile('|'.join(map(re.escape, keywords)))
+
+
+def _fill_unknown(labels: pd.Series) -> pd.Series:
+    """Fill missing path labels with 'Unknown', adding it as a category if needed."""
+    if isinstance(labels.dtype, pd.CategoricalDtype) and 'Unknown' not in labels.cat.categories:
+        labels = labels.cat.add_categories(['Unknown'])
+    return labels.fillna('Unknown')
+
 
 class PlotGenerator:
     def __init__(self):
@@ -36,6 +149,87 @@ class PlotGenerator:
         self.supported_plot_types = ['sunburst', 'bar']  # Support both sunburst and bar charts
         self.remove_keywords = ['Tổng', 'Cộng']  # Default filter keywords for total columns
     
+    def _is_total_column(self, column_name: str) -> bool:
+        """
+        Check if a column name contains any of the total keywords, using one
+        precompiled alternation instead of a substring scan per keyword.
+        """
+        if not self.remove_keywords:
+            return False
+        pattern = _compile_keyword_pattern(tuple(self.remove_keywords))
+        return pattern.search(column_name) is not None
+    
+    def _export_figure(self, fig, plot_format: str = 'html') -> Dict:
+        """
+        Serialize a figure for the response.
+        
+        'html' (default) gives a standalone document in 'html_content'. The
+        frontend shows it in an iframe and offers it as a download, so keep a
+        full document but load plotly.js from the CDN instead of inlining the
+        ~3 MB bundle into every plot. 'json' skips HTML generation and returns
+        the figure JSON in 'plot_json' for rendering with plotly.js directly.
+        """
+        if plot_format == 'json':
+            # The figure was validated when it was built
+            return {'html_content': None, 'plot_json': fig.to_json(validate=False)}
+        return {'html_content': fig.to_html(include_plotlyjs='cdn')}
+    
+    def _plot_cache_digest(self, kind: str, frontend_data: Dict) -> str:
+        """Digest the plot kind, data and filter keywords into a cache key."""
+        payload = json.dumps(
+            {'kind': kind, 'data': frontend_data, 'remove_keywords': self.remove_keywords},
+            sort_keys=True, default=str
+        )
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _get_cached_plot(self, kind: str, digest: str) -> Optional[Dict]:
+        """Return a copy of the cached result for digest, or None."""
+        with _plot_cache_lock:
+            cached = _plot_cache.get(digest)
+            if cached is not None:
+                _plot_cache.move_to_end(digest)
+        if cached is None:
+            return None
+        logger.info(f"♻️ [PLOTTING] Reusing cached {kind} plot result")
+        return copy.deepcopy(cached)
+    
+    def _store_plot(self, digest: str, result: Dict):
+        """Cache a copy of a successful plot result."""
+        if not result.get('success'):
+            return
+        with _plot_cache_lock:
+            _plot_cache[digest] = copy.deepcopy(result)
+            while len(_plot_cache) > MAX_CACHED_PLOTS:
+                _plot_cache.popitem(last=False)
+    
+    def _cached_plot(self, kind: str, frontend_data: Dict, generate) -> Dict:
+        """
+        Return generate(frontend_data), reusing the result of an earlier call
+        with the same plot kind, data and filter keywords.
+        """
+        digest = self._plot_cache_digest(kind, frontend_data)
+        cached = self._get_cached_plot(kind, digest)
+        if cached is not None:
+            return cached
+        
+        result = generate(frontend_data)
+        self._store_plot(digest, result)
+        return result
+    
+    async def _cached_plot_async(self, kind: str, frontend_data: Dict, generate) -> Dict:
+        """
+        Like _cached_plot, but run generate in the plotting process pool. The
+        cache is checked and filled in this process.
+        """
+        digest = self._plot_cache_digest(kind, frontend_data)
+        cached = self._get_cached_plot(kind, digest)
+        if cached is not None:
+            return cached
+        
+        result = await asyncio.get_running_loop().run_in_executor(_get_plot_pool(), generate, frontend_data)
+        self._store_plot(digest, result)
+        return result
+    
     def _is_simple_structure_for_bar_chart(self, frontend_data: Dict) -> bool:
         """
         Check if data structure is simple enough for bar charts.
@@ -65,72 +259,90 @@ class PlotGenerator:
         """
         Analyze the header_matrix to understand the true hierarchical structure.
         """
-        # Build position to header mapping for each level
-        level_structures = {}
-        for level_idx, level in enumerate(header_matrix):
-            level_structures[level_idx] = {}
-            for header in level:
-                for pos in range(header['position'], header['position'] + header['colspan']):
-                    level_structures[level_idx][pos] = header['text']
-        
         # Determine the actual data structure
         data_length = len(data_rows[0]) if data_rows else 0
         columns_length = len(final_columns)
         
-        # Find categorical vs numeric columns based on data analysis
+        # Build a dense level x position table of header texts in one sweep,
+        # so looking up a column's headers is a single column slice. Only
+        # data positions are ever looked up; has_header marks the positions
+        # some header covers at each level (a later header wins on overlap).
+        header_text = np.full((len(header_matrix), data_length), None, dtype=object)
+        has_header = np.zeros((len(header_matrix), data_length), dtype=bool)
+        for level_idx, level in enumerate(header_matrix):
+            for header in level:
+                start = max(header['position'], 0)
+                end = header['position'] + header['colspan']
+                if start < end:
+                    header_text[level_idx, start:end] = header['text']
+                    has_header[level_idx, start:end] = True
+        
+        # Find categorical vs numeric columns based on data analysis: a column
+        # is numeric when every non-empty cell parses as a number, so one odd
+        # row (e.g. a text first row) doesn't decide the whole column
         categorical_positions = []
         numeric_positions = []
         
         if data_rows:
-            first_row = data_rows[0]
-            for i, value in enumerate(first_row):
-                try:
-                    float(value)
-                    numeric_positions.append(i)
-                except (ValueError, TypeError):
-                    categorical_positions.append(i)
-        
-        # Map data positions to header_matrix positions
-        data_to_header_position = {}
-        for i in range(data_length):
-            data_to_header_position[i] = i
+            table = pd.DataFrame(data_rows, dtype=object).iloc[:, :data_length]
+            is_empty = table.isna()
+            parsed = table.apply(pd.to_numeric, errors='coerce')
+            numeric_mask = ((parsed.notna() | is_empty).all(axis=0) & ~is_empty.all(axis=0)).to_numpy()
+            numeric_positions = np.flatnonzero(numeric_mask).tolist()
+            categorical_positions = np.flatnonzero(~numeric_mask).tolist()
         
         return {
-            "level_structures": level_structures,
+            "header_text": header_text,
+            "has_header": has_header,
             "categorical_positions": categorical_positions,
             "numeric_positions": numeric_positions,
-            "data_to_header_position": data_to_header_position,
             "data_length": data_length,
             "columns_length": columns_length
         }
 
-    def _build_column_hierarchy_paths(self, header_matrix: List[List[Dict[str, Any]]], position: int) -> List[str]:
+    def _build_column_hierarchy_paths(self, header_text: np.ndarray, has_header: np.ndarray, position: int) -> List[str]:
         """
         Build the complete hierarchy path for a specific column position.
-        """
-        hierarchy_path = []
         
-        # Go through each level and find the header that covers this position
-        for level_idx, level in enumerate(header_matrix):
-            for header in level:
-                if header['position'] <= position < header['position'] + header['colspan']:
-                    hierarchy_path.append(header['text'])
-                    break
+        header_text and has_header are the dense level x position tables
+        from _analyze_header_matrix_structure, so this is one column slice.
+        """
+        # Take the header covering this position at each level, removing
+        # duplicates while preserving order
+        return list(dict.fromkeys(header_text[has_header[:, position], position].tolist()))
+
+    def _prepare_sunburst_frame(self, df: pd.DataFrame, path_columns: List[str]) -> pd.DataFrame:
+        """
+        Take the path and value columns the sunbursts need from df, with
+        missing path labels filled with 'Unknown' and the path columns
+        categorical so grouping works on int codes.
         
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_path = []
-        for item in hierarchy_path:
-            if item not in seen:
-                seen.add(item)
-                unique_path.append(item)
+        Both priority variants plot the same columns in a different order,
+        so this is done once and the frame is shared between them.
+        """
+        def _path_labels(labels: pd.Series) -> pd.Series:
+            labels = _fill_unknown(labels)
+            if not isinstance(labels.dtype, pd.CategoricalDtype):
+                labels = labels.astype('category')
+            return labels
         
-        return unique_path
+        path_columns = [col for col in dict.fromkeys(path_columns) if col in df.columns]
+        return pd.DataFrame({
+            col: _path_labels(df[col]) if col in path_columns else df[col]
+            for col in dict.fromkeys(path_columns + ['value'])
+        })
 
     def _create_single_sunburst(self, df: pd.DataFrame, categorical_names: List[str], col_level_cols: List[str], 
-                               priority: str, filename: str) -> Dict:
+                               priority: str, filename: str, root_path: Optional[List[Any]] = None,
+                               plot_format: str = 'html') -> Dict:
         """
         Create a single sunburst plot with specified priority.
+        
+        df is the shared frame from _prepare_sunburst_frame and is not modified.
+        
+        If root_path (labels of the first hierarchy levels) is given, only the
+        data under it is plotted, down to SUNBURST_DRILLDOWN_LEVELS levels
+        below it, and the result lists the paths that can be drilled into next.
         """
         if priority == 'column':
             plot_path = col_level_cols + categorical_names
@@ -143,58 +355,79 @@ class PlotGenerator:
         valid_plot_path = [col for col in plot_path if col in df.columns]
         plot_path = valid_plot_path
 
-        # Handle None values in the path columns
-        df_copy = df.copy()
-        for col in plot_path:
-            if col in df_copy.columns:
-                df_copy[col] = df_copy[col].fillna('Unknown')
+        # plotly.express is slow to import, so it is only loaded once plots are built
+        import plotly.express as px
+        
+        df_copy = df
+        
+        # Plotly builds the tree from distinct leaf paths, so sum duplicate
+        # paths here rather than handing it one row per record. An invalid
+        # path (empty or repeating a column) is left for Plotly to report.
+        drilldown_paths = None
+        if plot_path and len(set(plot_path)) == len(plot_path):
+            if root_path is not None:
+                root_path = list(root_path)[:len(plot_path)]
+                under_root = np.ones(len(df_copy), dtype=bool)
+                for col, label in zip(plot_path, root_path):
+                    under_root &= (df_copy[col] == label).to_numpy()
+                df_copy = df_copy[under_root]
+                if df_copy.empty:
+                    raise ValueError(f"No data found under root path {root_path}")
+                
+                # Only render a few levels below the root; deeper levels are
+                # requested again with one of drilldown_paths as the root
+                shown_depth = len(root_path) + SUNBURST_DRILLDOWN_LEVELS
+                if shown_depth < len(plot_path):
+                    plot_path = plot_path[:shown_depth]
+                    drilldown_paths = df_copy[plot_path].drop_duplicates().values.tolist()
+                else:
+                    drilldown_paths = []
+            
+            df_copy = df_copy.groupby(plot_path, as_index=False, sort=False, observed=True)['value'].sum()
         
         # Create the sunburst plot without title
         fig = px.sunburst(
             df_copy,
             path=plot_path,
-            values='value',
-            hover_data={'value': True}
+            values='value'
         )
 
-        # Enhanced sunburst configuration with square layout
-        fig.update_layout(
-            margin=dict(t=80, l=25, r=25, b=25),  # Reduced top margin since no title
-            font=dict(size=11),
-            showlegend=False,
-            width=600,   # Set fixed width for square aspect
-            height=600   # Set fixed height for square aspect
-        )
-        
-        fig.update_traces(
-            insidetextorientation='radial',
-            textinfo="label+percent parent",
-            maxdepth=6,
-            branchvalues="total"
-        )
+        # Enhanced sunburst configuration with square layout, applied in
+        # one layout and one trace update
+        fig.update_layout(**SUNBURST_LAYOUT)
+        fig.update_traces(**SUNBURST_TRACE)
         
-        fig.update_traces(
-            hovertemplate='<b>%{label}</b><br>' +
-                         'Value: %{value}<br>' +
-                         'Percentage of parent: %{percentParent}<br>' +
-                         'Path: %{currentPath}<br>' +
-                         '<extra></extra>'
-        )
-        
-        # Convert to HTML
-        html_content = fig.to_html()
-        
-        return {
+        result = {
             'title': title,
-            'html_content': html_content,
+            **self._export_figure(fig, plot_format),
             'hierarchy': plot_path,
             'priority': priority
         }
+        if drilldown_paths is not None:
+            result['root_path'] = root_path
+            result['drilldown_paths'] = drilldown_paths
+        return result
 
     def generate_sunburst_plots(self, frontend_data: Dict) -> Dict:
+        """
+        Generate both column-first and row-first sunburst plots from frontend JSON data,
+        reusing the result for data that was plotted recently.
+        """
+        return self._cached_plot('sunburst', frontend_data, self._generate_sunburst_plots)
+    
+    async def generate_sunburst_plots_async(self, frontend_data: Dict) -> Dict:
+        """Async generate_sunburst_plots that builds the plots in a worker process."""
+        return await self._cached_plot_async('sunburst', frontend_data, self._generate_sunburst_plots)
+    
+    def _generate_sunburst_plots(self, frontend_data: Dict) -> Dict:
         """
         Generate both column-first and row-first sunburst plots from frontend JSON data.
         Returns both variants for maximum flexibility.
+        
+        frontend_data may carry 'root_paths', mapping a priority ('column' or
+        'row') to the labels to drill into; that variant then renders only
+        the levels just below those labels (see _create_single_sunburst).
+        It may also set 'plot_format' to 'json' (see _export_figure).
         """
         try:
             logger.info(f"🎨 [PLOTTING] Starting sunburst plot generation")
@@ -205,6 +438,8 @@ class PlotGenerator:
             header_matrix = frontend_data.get('header_matrix', [])
             has_multiindex = frontend_data.get('has_multiindex', False)
             filename = frontend_data.get('filename', 'table')
+            root_paths = frontend_data.get('root_paths') or {}
+            plot_format = frontend_data.get('plot_format', 'html')
             
             logger.info(f"🔍 [PLOTTING] Input data analysis:")
             logger.info(f"  📋 final_columns: {len(final_columns)} items")
@@ -220,19 +455,20 @@ class PlotGenerator:
                     'error': 'No data found in JSON. Required: final_columns and data_rows'
                 }
 
-            # Log first data row for type analysis
-            if data_rows:
+            # Log first data row for type analysis; this walks the whole row,
+            # so only do it when debug logging is on
+            if data_rows and logger.isEnabledFor(logging.DEBUG):
                 first_row = data_rows[0]
-                logger.info(f"🔍 [PLOTTING] First data row analysis:")
-                logger.info(f"  📊 Length: {len(first_row)}")
-                logger.info(f"  📊 Values: {first_row}")
-                logger.info(f"  📊 Types: {[type(cell).__name__ for cell in first_row]}")
+                logger.debug("🔍 [PLOTTING] First data row analysis:")
+                logger.debug("  📊 Length: %d", len(first_row))
+                logger.debug("  📊 Values: %s", first_row)
+                logger.debug("  📊 Types: %s", [type(cell).__name__ for cell in first_row])
                 
                 # Check for problematic types
                 for i, cell in enumerate(first_row):
                     cell_type = str(type(cell))
                     if 'numpy' in cell_type:
-                        logger.warning(f"  ⚠️ NUMPY TYPE at position {i}: {cell_type} = {cell}")
+                        logger.debug("  ⚠️ NUMPY TYPE at position %d: %s = %s", i, cell_type, cell)
 
             # Analyze the header_matrix structure properly
             logger.info(f"🔧 [PLOTTING] Analyzing header matrix structure...")
@@ -241,12 +477,12 @@ class PlotGenerator:
             # Get categorical and numeric column information
             categorical_positions = structure_info["categorical_positions"]
             numeric_positions = structure_info["numeric_positions"]
-            data_to_header_position = structure_info["data_to_header_position"]
-            level_structures = structure_info["level_structures"]
+            header_text = structure_info["header_text"]
+            has_header = structure_info["has_header"]
             
             logger.info(f"📊 [PLOTTING] Structure analysis results:")
-            logger.info(f"  🏷️ Categorical positions: {categorical_positions}")
-            logger.info(f"  🔢 Numeric positions (before filtering): {numeric_positions}")
+            logger.debug("  🏷️ Categorical positions: %s", categorical_positions)
+            logger.debug("  🔢 Numeric positions (before filtering): %s", numeric_positions)
             logger.info(f"  📏 Data length: {structure_info['data_length']}")
             logger.info(f"  📏 Columns length: {structure_info['columns_length']}")
             
@@ -259,13 +495,13 @@ class PlotGenerator:
             for pos in numeric_positions:
                 if pos < len(final_columns):
                     column_name = final_columns[pos]
-                    should_filter = any(keyword in column_name for keyword in self.remove_keywords)
+                    should_filter = self._is_total_column(column_name)
                     if should_filter:
                         filtered_out_positions.append(pos)
-                        logger.info(f"  ❌ FILTERED OUT position {pos}: {column_name}")
+                        logger.debug("  ❌ FILTERED OUT position %d: %s", pos, column_name)
                     else:
                         numeric_positions_filtered.append(pos)
-                        logger.info(f"  ✅ KEEPING position {pos}: {column_name}")
+                        logger.debug("  ✅ KEEPING position %d: %s", pos, column_name)
                 else:
                     logger.warning(f"  ⚠️ Position {pos} >= final_columns length {len(final_columns)}")
             
@@ -276,7 +512,7 @@ class PlotGenerator:
             logger.info(f"  📋 Original numeric positions: {len(original_numeric_positions)}")
             logger.info(f"  📋 Filtered out positions: {len(filtered_out_positions)}")
             logger.info(f"  📋 Final numeric positions: {len(numeric_positions)}")
-            logger.info(f"  🔢 Numeric positions (after filtering): {numeric_positions}")
+            logger.debug("  🔢 Numeric positions (after filtering): %s", numeric_positions)
             
             if not numeric_positions:
                 logger.error(f"❌ [SUNBURST FILTERING] No valid numeric columns found after filtering")
@@ -285,121 +521,95 @@ class PlotGenerator:
                     'error': 'No valid numeric columns found to plot after filtering out totals'
                 }
             
-            # Get categorical column names from the header_matrix
-            categorical_names = []
-            for cat_pos in categorical_positions:
-                header_pos = data_to_header_position[cat_pos]
-                # Get the name from level 0 of header_matrix
-                if 0 in level_structures and header_pos in level_structures[0]:
-                    categorical_names.append(level_structures[0][header_pos])
-                else:
-                    categorical_names.append(f"Category_{cat_pos}")
+            # Get categorical column names from level 0 of the header_matrix;
+            # data positions index the header table directly
+            if len(header_text):
+                top_level_names = header_text[0, categorical_positions].tolist()
+                top_level_covered = has_header[0, categorical_positions].tolist()
+            else:
+                top_level_names = [None] * len(categorical_positions)
+                top_level_covered = [False] * len(categorical_positions)
+            categorical_names = [
+                name if covered else f"Category_{cat_pos}"
+                for cat_pos, name, covered in zip(categorical_positions, top_level_names, top_level_covered)
+            ]
             
             logger.info(f"🏷️ [PLOTTING] Categorical column names: {categorical_names}")
             
-            # Prepare data for plotting
+            # Prepare data for plotting: one record per (row, numeric column),
+            # built column-wise over the whole table instead of cell by cell
             logger.info(f"🔄 [PLOTTING] Processing data rows for plotting...")
-            plot_data = []
+            logger.debug("🔍 [PLOTTING] First row: %s", data_rows[0])
             
-            for row_idx, data_row in enumerate(data_rows):
-                if row_idx == 0:
-                    logger.info(f"🔍 [PLOTTING] Processing first row (index {row_idx}):")
-                    logger.info(f"  📊 Row data: {data_row}")
-                    logger.info(f"  📊 Row types: {[type(cell).__name__ for cell in data_row]}")
-                
-                # Extract categorical values
-                row_categories = {}
-                for i, cat_pos in enumerate(categorical_positions):
-                    if cat_pos < len(data_row) and i < len(categorical_names):
-                        cat_value = str(data_row[cat_pos])
-                        row_categories[categorical_names[i]] = cat_value
-                        if row_idx == 0:
-                            logger.info(f"    🏷️ {categorical_names[i]} = {cat_value}")
-                
-                # Process each numeric column
-                for num_pos in numeric_positions:
-                    if num_pos >= len(data_row):
-                        logger.warning(f"⚠️ [PLOTTING] Numeric position {num_pos} >= row length {len(data_row)}")
-                        continue
-                    
-                    # Get the header position for this data position
-                    header_pos = data_to_header_position[num_pos]
-                    
-                    # Build the complete hierarchy path for this column
-                    hierarchy_path = self._build_column_hierarchy_paths(header_matrix, header_pos)
-                    
-                    if row_idx == 0:
-                        logger.info(f"    🔢 Numeric position {num_pos} -> header {header_pos} -> path {hierarchy_path}")
-                    
-                    record = {}
-                    
-                    # Add categorical data
-                    for cat_name, cat_value in row_categories.items():
-                        record[cat_name] = cat_value
-                    
-                    # Add column hierarchy levels
-                    for level_idx, level_name in enumerate(hierarchy_path):
-                        record[f'Col_Level_{level_idx}'] = level_name
-                    
-                    # Add data value - CRITICAL: Convert to native Python types
-                    raw_value = data_row[num_pos]
-                    if row_idx == 0:
-                        logger.info(f"    💰 Raw value at position {num_pos}: {raw_value} (type: {type(raw_value).__name__})")
-                    
-                    try:
-                        # Convert to pandas numeric, then to native Python type
-                        actual_value = pd.to_numeric(raw_value, errors='coerce')
-                        if pd.notna(actual_value):
-                            # Convert numpy types to native Python types
-                            if hasattr(actual_value, 'item'):
-                                # numpy scalar -> Python scalar
-                                python_value = actual_value.item()
-                            else:
-                                # Already Python type
-                                python_value = float(actual_value)
-                            record['value'] = python_value
-                            if row_idx == 0:
-                                logger.info(f"    ✅ Converted value: {python_value} (type: {type(python_value).__name__})")
-                        else:
-                            record['value'] = 0
-                            if row_idx == 0:
-                                logger.info(f"    ⚠️ NaN value converted to 0")
-                    except (ValueError, TypeError, IndexError) as e:
-                        record['value'] = 0
-                        if row_idx == 0:
-                            logger.warning(f"    ❌ Value conversion failed: {e}, using 0")
-                    
-                    plot_data.append(record)
+            # Rows may be ragged: a cell past the end of its row is missing,
+            # which is different from a None cell
+            table = pd.DataFrame(data_rows, dtype=object).to_numpy()
+            row_lengths = np.fromiter((len(row) for row in data_rows), dtype=np.intp, count=len(data_rows))
+            
+            # Records are emitted row by row, skipping numeric cells missing from short rows
+            numeric_pos_array = np.asarray(numeric_positions, dtype=np.intp)
+            record_mask = numeric_pos_array[np.newaxis, :] < row_lengths[:, np.newaxis]
+            record_rows, record_cols = np.nonzero(record_mask)
             
-            logger.info(f"📊 [PLOTTING] Created {len(plot_data)} plot records")
+            logger.info(f"📊 [PLOTTING] Created {len(record_rows)} plot records")
             
-            if not plot_data:
+            if not len(record_rows):
                 logger.error(f"❌ [PLOTTING] No plot data generated")
                 return {
                     'success': False,
                     'error': 'No data to plot after processing'
                 }
-                
+            
+            plot_columns = {}
+            
+            # Path labels repeat across records, so each label column is
+            # factorized once per row (or per numeric column) and records
+            # just gather the int codes into a Categorical
+            
+            # Add categorical data (as strings); a later column with the same name wins
+            row_labels = {}
+            for cat_name, cat_pos in zip(categorical_names, categorical_positions):
+                present_rows = cat_pos < row_lengths
+                if not present_rows[record_rows].any():
+                    continue
+                cat_values = table[:, cat_pos].astype(str).astype(object)
+                cat_values[~present_rows] = np.nan
+                if cat_name in row_labels:
+                    previous = row_labels[cat_name]
+                    cat_values[~present_rows] = previous[~present_rows]
+                row_labels[cat_name] = cat_values
+            for cat_name, cat_values in row_labels.items():
+                codes, labels = pd.factorize(cat_values)
+                plot_columns[cat_name] = pd.Categorical.from_codes(codes[record_rows], categories=labels)
+            
+            # Add column hierarchy levels: each numeric column's path is built once
+            hierarchy_paths = []
+            for num_pos in numeric_positions:
+                hierarchy_path = self._build_column_hierarchy_paths(header_text, has_header, num_pos)
+                logger.debug("    🔢 Numeric position %d -> path %s", num_pos, hierarchy_path)
+                hierarchy_paths.append(hierarchy_path)
+            max_depth = max(len(hierarchy_paths[k]) for k in np.unique(record_cols))
+            for level_idx in range(max_depth):
+                level_names = np.array(
+                    [path[level_idx] if level_idx < len(path) else np.nan for path in hierarchy_paths],
+                    dtype=object
+                )
+                codes, labels = pd.factorize(level_names)
+                plot_columns[f'Col_Level_{level_idx}'] = pd.Categorical.from_codes(codes[record_cols], categories=labels)
+            
+            # Add data values: coerce the whole numeric block in one call,
+            # with unparseable or missing values counted as 0
+            raw_values = table[record_rows, numeric_pos_array[record_cols]]
+            values = pd.to_numeric(pd.Series(raw_values, dtype=object), errors='coerce').to_numpy(dtype=float)
+            plot_columns['value'] = np.nan_to_num(values, nan=0.0, posinf=np.inf, neginf=-np.inf)
+            
             # Create DataFrame and log its structure
             logger.info(f"🐼 [PLOTTING] Creating pandas DataFrame...")
-            df = pd.DataFrame(plot_data)
+            df = pd.DataFrame(plot_columns, copy=False)  # The column arrays are fresh, no need to copy them
             logger.info(f"📊 [PLOTTING] DataFrame created:")
             logger.info(f"  📏 Shape: {df.shape}")
             logger.info(f"  📋 Columns: {list(df.columns)}")
-            logger.info(f"  📊 Data types: {dict(df.dtypes)}")
-            
-            # Check for any remaining numpy types in DataFrame
-            for col in df.columns:
-                col_dtype = str(df[col].dtype)
-                if 'int64' in col_dtype or 'float64' in col_dtype:
-                    logger.info(f"  🔢 Column '{col}' has pandas dtype: {col_dtype}")
-                    # Convert pandas dtypes to native Python types
-                    if 'int64' in col_dtype:
-                        df[col] = df[col].astype(int)
-                        logger.info(f"    ✅ Converted {col} to native int")
-                    elif 'float64' in col_dtype:
-                        df[col] = df[col].astype(float)
-                        logger.info(f"    ✅ Converted {col} to native float")
+            logger.debug("  📊 Data types: %s", df.dtypes.to_dict())
             
             # Get column level columns
             col_level_cols = [col for col in df.columns if col.startswith('Col_Level_')]
@@ -408,12 +618,15 @@ class PlotGenerator:
             logger.info(f"📊 [PLOTTING] Column hierarchy levels: {col_level_cols}")
             logger.info(f"🏷️ [PLOTTING] Categorical columns: {categorical_names}")
             
-            # Generate both priority variants
+            # Generate both priority variants from one shared frame
+            sunburst_df = self._prepare_sunburst_frame(df, col_level_cols + categorical_names)
             logger.info(f"🎨 [PLOTTING] Generating column-first sunburst...")
-            column_first = self._create_single_sunburst(df, categorical_names, col_level_cols, 'column', filename)
+            column_first = self._create_single_sunburst(sunburst_df, categorical_names, col_level_cols, 'column', filename,
+                                                        root_path=root_paths.get('column'), plot_format=plot_format)
             
             logger.info(f"🎨 [PLOTTING] Generating row-first sunburst...")
-            row_first = self._create_single_sunburst(df, categorical_names, col_level_cols, 'row', filename)
+            row_first = self._create_single_sunburst(sunburst_df, categorical_names, col_level_cols, 'row', filename,
+                                                     root_path=root_paths.get('row'), plot_format=plot_format)
             
             # Calculate analysis metrics
             total_value = float(df['value'].sum())  # Ensure native Python float
@@ -455,6 +668,17 @@ class PlotGenerator:
             }
 
     def generate_bar_plots(self, frontend_data: Dict) -> Dict:
+        """
+        Generate bar chart from simple flat table data, reusing the result for
+        data that was plotted recently.
+        """
+        return self._cached_plot('bar', frontend_data, self._generate_bar_plots)
+    
+    async def generate_bar_plots_async(self, frontend_data: Dict) -> Dict:
+        """Async generate_bar_plots that builds the chart in a worker process."""
+        return await self._cached_plot_async('bar', frontend_data, self._generate_bar_plots)
+    
+    def _generate_bar_plots(self, frontend_data: Dict) -> Dict:
         """
         Generate bar chart from simple flat table data.
         
@@ -462,6 +686,8 @@ class PlotGenerator:
         - Single categorical column (feature_rows)
         - Multiple numeric columns representing time series or categories
         - Automatic filtering of total/summary columns
+        
+        frontend_data may set 'plot_format' to 'json' (see _export_figure).
         """
         try:
             logger.info(f"📊 [BAR PLOTTING] Starting bar chart generation")
@@ -496,6 +722,13 @@ class PlotGenerator:
             categorical_col = feature_rows[0]
             logger.info(f"📊 [BAR PLOTTING] Categorical column: {categorical_col}")
             
+            if categorical_col not in final_columns:
+                logger.error(f"❌ [BAR PLOTTING] Categorical column {categorical_col} not found in final_columns")
+                return {
+                    'success': False,
+                    'error': f'Categorical column {categorical_col} not found in final_columns'
+                }
+            
             # Identify numeric columns (all columns except categorical)
             potential_numeric_cols = [col for col in final_columns if col not in feature_rows]
             
@@ -504,7 +737,7 @@ class PlotGenerator:
             filtered_out_cols = []
             
             for col in potential_numeric_cols:
-                should_filter = any(keyword in col for keyword in self.remove_keywords)
+                should_filter = self._is_total_column(col)
                 if should_filter:
                     filtered_out_cols.append(col)
                 else:
@@ -522,17 +755,23 @@ class PlotGenerator:
                     'error': 'No valid numeric columns found to plot after filtering out totals'
                 }
             
-            # Create DataFrame
-            df = pd.DataFrame(data_rows, columns=final_columns)
-            logger.info(f"📊 [BAR PLOTTING] DataFrame created: {df.shape}")
-            
-            # Melt the DataFrame to long format for plotting
-            df_melted = df.melt(
-                id_vars=[categorical_col],
-                value_vars=numeric_cols_to_plot,
-                var_name='Metric',
-                value_name='Value'
-            )
+            # Build the long format for plotting straight from the rows. The
+            # rows are only boxed as objects; the category and plotted
+            # columns get their dtypes inferred, the total columns never do.
+            # Records are metric by metric, as DataFrame.melt produced them.
+            table = pd.DataFrame(data_rows, columns=final_columns, dtype=object)
+            logger.info(f"📊 [BAR PLOTTING] DataFrame created: {table.shape}")
+            
+            metric_positions = pd.unique(table.columns.get_indexer_for(numeric_cols_to_plot))
+            categories = table[categorical_col].infer_objects()
+            df_melted = pd.DataFrame({
+                categorical_col: np.tile(categories.to_numpy(), len(metric_positions)),
+                'Metric': table.columns[metric_positions].repeat(len(table)),
+                'Value': pd.concat(
+                    [table.iloc[:, pos].infer_objects() for pos in metric_positions],
+                    ignore_index=True
+                ).to_numpy()
+            })
             
             logger.info(f"📊 [BAR PLOTTING] DataFrame melted: {df_melted.shape}")
             
@@ -562,21 +801,27 @@ class PlotGenerator:
                     else:
                         return col_name
             
-            df_melted['MetricLabel'] = df_melted['Metric'].apply(simplify_column_name)
-            
-            # Sort by metric labels for consistent ordering
-            try:
-                # Try to extract numbers for sorting (for time-based data)
-                df_melted['Metric_Number'] = df_melted['MetricLabel'].str.extract(r'(\d+)').astype(int)
+            # Metric only holds the plotted column names, so simplify each
+            # name once and map the labels onto the rows (kept as object
+            # dtype, which map doesn't do for an empty frame)
+            label_map = {col: simplify_column_name(col) for col in df_melted['Metric'].unique()}
+            df_melted['MetricLabel'] = df_melted['Metric'].map(label_map).astype(object, copy=False)
+            
+            # Sort by metric labels for consistent ordering: by the number in
+            # each label (for time-based data) when every label has one
+            metric_numbers = df_melted['MetricLabel'].str.extract(r'(\d+)', expand=False)
+            if metric_numbers.notna().all():
+                df_melted['Metric_Number'] = pd.to_numeric(metric_numbers)
                 df_melted = df_melted.sort_values(by=['Metric_Number'])
                 logger.info(f"📊 [BAR PLOTTING] Sorted by numeric metric order")
-            except Exception:
+            else:
                 # Fallback to alphabetical sorting
                 df_melted = df_melted.sort_values(by=['MetricLabel'])
                 logger.info(f"📊 [BAR PLOTTING] Sorted alphabetically")
             
             # Create bar chart
             logger.info(f"🎨 [BAR PLOTTING] Creating bar chart...")
+            import plotly.express as px
             fig = px.bar(
                 df_melted,
                 x='MetricLabel',
@@ -612,8 +857,8 @@ class PlotGenerator:
                 height=500
             )
             
-            # Convert to HTML - consistent with sunburst approach
-            html_content = fig.to_html()
+            # Serialize - consistent with sunburst approach
+            exported = self._export_figure(fig, frontend_data.get('plot_format', 'html'))
             
             # Calculate analysis metrics
             total_value = float(df_melted['Value'].sum())
@@ -629,7 +874,7 @@ class PlotGenerator:
                 'plots': {
                     'bar_chart': {
                         'title': f"Bar Chart: {filename}",
-                        'html_content': html_content,
+                        **exported,
                         'categorical_column': categorical_col,
                         'metrics_plotted': numeric_cols_to_plot,
                         'filtered_columns': filtered_out_cols
@@ -25,7 +25,7 @@ from .postprocess import TablePostProcessor
 from .utils import get_feature_name_content, format_row_dict_for_llm, format_col_dict_for_llm
 from .metadata import get_number_of_row_header, convert_df_headers_to_nested_dict, convert_df_rows_to_nested_dict
 from .prompt import FILE_SUMMARY_PROMPT, QUERY_SEPARATOR_PROMPT
-from .alias_handler import AliasEnricher
+from .alias_handler import default_alias_enricher
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -59,8 +59,8 @@ class MultiFileProcessor:
     def __init__(self):
         self.file_metadata = {}
         self.post_processor = TablePostProcessor()
-        # AliasEnricher will get its LLM instance on-demand
-        self.alias_enricher = AliasEnricher()
+        # Shared enricher: alias dictionaries are parsed once per process, not per conversation
+        self.alias_enricher = default_alias_enricher
     
     def extract_file_metadata(self, file_path, original_filename=None):
         """Extract and store metadata for a single file."""
@@ -211,17 +211,32 @@ class MultiFileProcessor:
 
         return assignments
     
-    def process_multi_file_query(self, query, alias_file_path=None):
+    async def aenrich_query(self, query, alias_file_path):
+        """
+        Enrich a query with aliases on the event loop (step 1 of
+        process_multi_file_query), returning the original query on failure.
+        """
+        logger.info(f"🔍 Enriching query with aliases from {alias_file_path}")
+        enriched_query = await self.alias_enricher.aenrich_query(query, alias_file_path)
+        logger.info(f"📝 Original query: {query}")
+        logger.info(f"✨ Enriched query: {enriched_query}")
+        return enriched_query
+    
+    def process_multi_file_query(self, query, alias_file_path=None, enriched_query=None):
         """
         Process a query that may involve multiple files.
         1. Enrich query with aliases (if alias file provided).
         2. Separate query.
         3. Process each sub-query.
         4. Combine and return results.
+        
+        If enriched_query is given (e.g. from aenrich_query), step 1 is skipped.
         """
         # Step 1: Enrich query with aliases if alias file is provided
-        enriched_query = query
-        if alias_file_path:
+        if enriched_query is not None:
+            logger.info(f"✨ Using enriched query: {enriched_query}")
+        elif alias_file_path:
+            enriched_query = query
             # The AliasEnricher will now get its own LLM instance internally
             try:
                 logger.info(f"🔍 Enriching query with aliases from {alias_file_path}")
@@ -231,6 +246,8 @@ class MultiFileProcessor:
             except Exception as e:
                 logger.warning(f"⚠️ Alias enrichment failed: {e}, using original query")
                 enriched_query = query
+        else:
+            enriched_query = query
         
         # Step 2: Separate query (using enriched query)
         assignments = self.separate_query(enriched_query)
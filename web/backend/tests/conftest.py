@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the backend packages (core, alias_manager, ...) the way app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# core.config requires an API key at import; tests never reach the real LLM
+os.environ.setdefault("GOOGLE_API_KEY_1", "test-key")
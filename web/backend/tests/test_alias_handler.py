@@ -0,0 +1,109 @@
+import asyncio
+
+import openpyxl
+import pytest
+
+from core import alias_handler
+from core.alias_handler import AliasEnricher
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+@pytest.fixture
+def alias_file(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Name", "Alias"])
+    sheet.append(["Doanh thu", "DT"])
+    path = tmp_path / "alias.xlsx"
+    workbook.save(path)
+    return str(path)
+
+
+def test_concurrent_enrichments_share_one_llm_call(alias_file, monkeypatch):
+    calls = []
+
+    class FakeLLM:
+        async def ainvoke(self, messages):
+            calls.append(messages)
+            await asyncio.sleep(0.01)
+            return FakeResponse("### Enriched Query\nenriched")
+
+    monkeypatch.setattr(alias_handler, "get_llm_instance", FakeLLM)
+    enricher = AliasEnricher()
+
+    async def scenario():
+        return await asyncio.gather(
+            enricher.aenrich_query("show DT", alias_file),
+            enricher.aenrich_query("show DT", alias_file),
+        )
+
+    assert asyncio.run(scenario()) == ["enriched", "enriched"]
+    assert len(calls) == 1
+
+
+def test_waiter_survives_cancelled_leader(alias_file, monkeypatch):
+    calls = []
+
+    async def scenario():
+        leader_started = asyncio.Event()
+
+        class FakeLLM:
+            async def ainvoke(self, messages):
+                calls.append(messages)
+                if len(calls) == 1:
+                    leader_started.set()
+                    await asyncio.Event().wait()  # Never answers; the leader is cancelled here
+                return FakeResponse("### Enriched Query\nenriched")
+
+        monkeypatch.setattr(alias_handler, "get_llm_instance", FakeLLM)
+        enricher = AliasEnricher()
+
+        leader = asyncio.create_task(enricher.aenrich_query("show DT", alias_file))
+        await leader_started.wait()
+        waiter = asyncio.create_task(enricher.aenrich_query("show DT", alias_file))
+        await asyncio.sleep(0)  # Let the waiter join the in-flight enrichment
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        # The waiter was not cancelled, so it enriches the query itself
+        assert await waiter == "enriched"
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_legacy_xls_saved_as_xlsx_is_read_with_pandas(tmp_path, monkeypatch):
+    # The alias manager stores .xls uploads under an .xlsx name
+    path = tmp_path / "alias_20240101_000000.xlsx"
+    path.write_bytes(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\x00" * 504)
+    read_with_pandas = []
+
+    class FakeExcelFile:
+        sheet_names = ["Sheet1"]
+
+        def __init__(self, file_path):
+            read_with_pandas.append(file_path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+    monkeypatch.setattr(alias_handler, "python_calamine", None)
+    monkeypatch.setattr(alias_handler.pd, "ExcelFile", FakeExcelFile)
+
+    assert alias_handler._read_sheet_names(str(path)) == ["Sheet1"]
+    assert read_with_pandas == [str(path)]
+
+
+def test_xlsx_is_read_with_openpyxl(alias_file, monkeypatch):
+    monkeypatch.setattr(alias_handler, "python_calamine", None)
+    formatted = alias_handler.format_excel_sheets(alias_file)
+    assert formatted == {"Sheet": ["Name: Doanh thu, Alias: DT"]}